@@ -53,22 +53,25 @@ background = background.convert()
 background.fill((250, 250, 250))
 screen.blit(background, (0, 0))
 
-# Draw edges
-for node in T.nodes:
-    if node.parent:
-        pygame.draw.aaline(
-            screen, (0, 0, 0), node.position(
-                rootpos, sizex, sizey), node.parent.position(
-                rootpos, sizex, sizey))
+# Get all positions at once: x0, y0, x1, y1, ...
+nodes = T.nodes
+xy = T.coordinates(rootpos, sizex, sizey)
+
+# Draw edges, all start and end points at once: x0, y0, x1, y1, ...
+edges = T.edges("straight", rootpos, sizex, sizey)
+for k in range(0, len(edges), 4):
+    pygame.draw.aaline(
+        screen, (0, 0, 0), (edges[k], edges[k + 1]),
+        (edges[k + 2], edges[k + 3]))
 
 # Draw vertices
-for node in T.nodes:
+for i, node in enumerate(nodes):
 
     myfont = pygame.font.Font(None, 36)
     label = myfont.render(node.data, 1, (0, 0, 0))
     textrect = label.get_rect()
-    textrect.centerx = node.position(rootpos, sizex, sizey)[0]
-    textrect.centery = node.position(rootpos, sizex, sizey)[1]
+    textrect.centerx = int(xy[2 * i])
+    textrect.centery = int(xy[2 * i + 1])
 
     p = textrect.copy().inflate(10, 10)
     pygame.draw.ellipse(screen, (255, 255, 255), p)
@@ -89,4 +92,10 @@ while True:
             pygame.display.quit()
             pygame.quit()
             sys.exit()
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            # Find the node under the mouse
+            node = T.nodeAt(event.pos[0], event.pos[1], rootpos, sizex, sizey,
+                            20)
+            if node is not None:
+                print("Clicked %s" % node.data)
     time.sleep(0.1)
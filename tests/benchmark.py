@@ -0,0 +1,315 @@
+"""
+Benchmark of treedraw.py
+
+Times the construction, layout, coordinate export and removal on trees
+with deterministic shapes and reports the time per node, the peak memory
+and the scaling exponent of every phase. The results can be written to a
+JSON file and compared with the results of an earlier run:
+
+python tests/benchmark.py --max-nodes 1000000 --json new.json
+python tests/benchmark.py --compare old.json
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import math
+import multiprocessing
+import platform
+import random
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+try:
+    import treedraw
+except ImportError:
+    import os
+    include = os.path.relpath(os.path.join(os.path.dirname(__file__), ".."))
+    sys.path.insert(0, include)
+    import treedraw
+
+from treedraw import Tree, CompactTree
+
+# Processes of the workers phase, --workers
+WORKERS = multiprocessing.cpu_count()
+
+
+# Tree shapes as parent arrays
+
+
+def balanced(n):
+    # Binary tree
+    return [-1] + [(i - 1) // 2 for i in range(1, n)]
+
+
+def chain(n):
+    return [-1] + [i - 1 for i in range(1, n)]
+
+
+def star(n):
+    return [-1] + [0] * (n - 1)
+
+
+def randomShape(n):
+    rnd = random.Random(n)
+    return [-1] + [rnd.randrange(i) for i in range(1, n)]
+
+
+def caterpillar(n):
+    # A chain where every node of the chain has an additional leaf
+    return [-1] + [i - 1 if i % 2 == 0 else i - 2 if i > 1 else 0
+                   for i in range(1, n)]
+
+
+SHAPES = {
+    "balanced": balanced,
+    "chain": chain,
+    "star": star,
+    "random": randomShape,
+    "caterpillar": caterpillar,
+}
+
+
+# Phases, each function gets the parent array and the state of the earlier
+# phases and returns the value to time
+
+
+def build(parents, state):
+    def run():
+        T = Tree(0)
+        nodes = [T.root]
+        for i in range(1, len(parents)):
+            nodes.append(nodes[parents[i]].addChild(i))
+        state["tree"] = T
+    return run
+
+
+def bulk(parents, state):
+    def run():
+        state["tree"] = Tree.fromParentArray(parents)
+    return run
+
+
+def walker(parents, state):
+    return lambda: state["tree"].walker(1.0)
+
+
+def workers(parents, state):
+    # The same layout with the subtrees in WORKERS processes, normalize()
+    # counts as a change so the last layout is not just rescaled
+    T = state["tree"]
+    T.normalize()
+    return lambda: T.walker(1.0, workers=WORKERS)
+
+
+def coordinates(parents, state):
+    return lambda: state["tree"].coordinates((10.0, 10.0), 20.0, 30.0)
+
+
+def compact(parents, state):
+    C = CompactTree.fromTree(state["tree"])
+    return lambda: C.walker(1.0)
+
+
+def remove(parents, state):
+    def run():
+        # Tear the tree down, one subtree of the root at a time
+        T = state["tree"]
+        for node in reversed(T.root.children):
+            T.removeChild(node)
+    return run
+
+
+PHASES = [
+    ("build", build),
+    ("bulk", bulk),
+    ("walker", walker),
+    ("workers", workers),
+    ("coordinates", coordinates),
+    ("compact", compact),
+    ("remove", remove),
+]
+
+
+def measure(shape, n, repeat):
+    # Time all phases, the best of repeat runs
+    parents = SHAPES[shape](n)
+    result = {}
+    for r in range(repeat):
+        state = {}
+        for name, phase in PHASES:
+            run = phase(parents, state)
+            gc.collect()
+            t = timeit.default_timer()
+            run()
+            t = timeit.default_timer() - t
+            if name not in result or t < result[name]:
+                result[name] = t
+    return result
+
+
+def peakMemory(shape, n):
+    # Peak memory of building and laying out the tree
+    if tracemalloc is None:
+        return None
+    parents = SHAPES[shape](n)
+    gc.collect()
+    tracemalloc.start()
+    T = Tree.fromParentArray(parents)
+    T.walker(1.0)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del T
+    return peak
+
+
+def exponent(sizes, times):
+    # Least squares fit of log(time) = a * log(n) + b, returns a
+    points = [(math.log(n), math.log(t)) for n, t in zip(sizes, times)
+              if t > 0]
+    if len(points) < 2:
+        return None
+    mx = sum(x for x, y in points) / len(points)
+    my = sum(y for x, y in points) / len(points)
+    sxx = sum((x - mx) ** 2 for x, y in points)
+    sxy = sum((x - mx) * (y - my) for x, y in points)
+    return sxy / sxx
+
+
+def run(shapes, sizes, repeat, memory):
+    results = {
+        "version": treedraw.__version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "sizes": sizes,
+        "shapes": {},
+    }
+    for shape in shapes:
+        phases = dict((name, {"seconds": [], "per_node_us": []})
+                      for name, phase in PHASES)
+        peaks = []
+        for n in sizes:
+            times = measure(shape, n, repeat)
+            for name, t in times.items():
+                phases[name]["seconds"].append(t)
+                phases[name]["per_node_us"].append(1e6 * t / n)
+            peaks.append(peakMemory(shape, n) if memory else None)
+            print("%-12s n=%-9d %s" % (shape, n, "  ".join(
+                "%s %.2fus" % (name, 1e6 * times[name] / n)
+                for name, phase in PHASES)))
+        for name in phases:
+            phases[name]["exponent"] = exponent(sizes,
+                                                phases[name]["seconds"])
+        results["shapes"][shape] = {
+            "phases": phases,
+            "peak_bytes": peaks,
+            "peak_bytes_per_node": [p / float(n) if p else None
+                                    for p, n in zip(peaks, sizes)],
+        }
+    return results
+
+
+def report(results):
+    print("")
+    print("Scaling exponent (1.0 is linear):")
+    print("%-12s %s" % ("", "".join("%12s" % name for name, phase in PHASES)))
+    for shape, result in sorted(results["shapes"].items()):
+        print("%-12s %s" % (shape, "".join(
+            "%12s" % "-" if result["phases"][name]["exponent"] is None
+            else "%12.2f" % result["phases"][name]["exponent"]
+            for name, phase in PHASES)))
+    print("")
+    print("Peak memory per node of fromParentArray() and walker():")
+    for shape, result in sorted(results["shapes"].items()):
+        print("%-12s %s" % (shape, "  ".join(
+            "n=%d %.0fB" % (n, p) if p else "n=%d -" % n
+            for n, p in zip(results["sizes"],
+                            result["peak_bytes_per_node"]))))
+
+
+def compare(results, baseline, tolerance):
+    # Compare the time per node of the largest common size, returns False
+    # if a phase got slower than the tolerance allows
+    ok = True
+    print("")
+    print("Compared with %s (Python %s):" % (baseline["version"],
+                                             baseline["python"]))
+    for shape, result in sorted(results["shapes"].items()):
+        if shape not in baseline["shapes"]:
+            continue
+        old = baseline["shapes"][shape]
+        common = [n for n in results["sizes"] if n in baseline["sizes"]]
+        if not common:
+            continue
+        n = common[-1]
+        i = results["sizes"].index(n)
+        j = baseline["sizes"].index(n)
+        for name, phase in PHASES:
+            if name not in old["phases"]:
+                continue
+            new_t = result["phases"][name]["per_node_us"][i]
+            old_t = old["phases"][name]["per_node_us"][j]
+            ratio = new_t / old_t if old_t else float("inf")
+            flag = ""
+            if ratio > tolerance:
+                flag = "  SLOWER"
+                ok = False
+            print("%-12s %-12s n=%-9d %8.2fus %8.2fus %6.2fx%s" % (
+                shape, name, n, old_t, new_t, ratio, flag))
+    return ok
+
+
+def main(argv=None):
+    global WORKERS
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--max-nodes", type=int, default=100000,
+                        help="largest tree, sizes are powers of ten")
+    parser.add_argument("--shapes", default=",".join(sorted(SHAPES)),
+                        help="comma separated list of %s" % ", ".join(
+                            sorted(SHAPES)))
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="best of this many runs")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="do not measure the peak memory")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="allowed slowdown for --compare")
+    parser.add_argument("--workers", type=int, default=WORKERS,
+                        help="processes of the workers phase")
+    args = parser.parse_args(argv)
+    WORKERS = args.workers
+
+    sizes = []
+    n = 1000
+    while n <= args.max_nodes:
+        sizes.append(n)
+        n *= 10
+    shapes = [shape.strip() for shape in args.shapes.split(",")]
+    for shape in shapes:
+        if shape not in SHAPES:
+            parser.error("unknown shape %r" % shape)
+
+    results = run(shapes, sizes, args.repeat, not args.no_memory)
+    report(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
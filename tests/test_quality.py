@@ -1,11 +1,27 @@
+import io
+import json
+import os
+import random
 import sys
+import tempfile
+import xml.etree.ElementTree as ET
+
+try:
+    from StringIO import StringIO  # Python 2, accepts str
+except ImportError:
+    from io import StringIO
+
+try:
+    import asyncio
+except ImportError:  # Python 2
+    asyncio = None
 try:
-    from treedraw import Tree, Node
+    from treedraw import Tree, Node, CompactTree, LayoutCache, Forest, LayoutSnapshot, closePools
 except ImportError:
     import os
     include = os.path.relpath(os.path.join(os.path.dirname(__file__), ".."))
     sys.path.insert(0, include)
-    from treedraw import Tree, Node
+    from treedraw import Tree, Node, CompactTree, LayoutCache, Forest, LayoutSnapshot, closePools
 
 def test_basic():
     # Build a tree
@@ -216,7 +232,7 @@ def test_dumbtreebuilding():
 
     T.walker(1.0)
 
-    # Traverse tree to get all nodes, T.nodes is not updated
+    # Traverse tree to get all nodes, T.nodes has the manually added ones at the end
     allnodes = getNodes_preorder(T)
 
     positions = [node.position() for node in allnodes]
@@ -227,6 +243,910 @@ def test_dumbtreebuilding():
 
     assert isExpected(nodes, [('a1', 0, 0), ('b2', -1, 1), ('d6', 2, 1), ('e3', -1, 2), ('f4', 0, 2), ('h10', 1, 2), ('i11', 3, 2), ('l12', 1, 3), ('m13', 2, 3), ('o15', 3, 3), ('p16', 4, 3)])
 
+def test_iterative():
+    # The iterative walks give the same coordinates as the recursive ones
+    for seed in range(20):
+        T = randomTree(300, seed)
+        T.walker(1.0, recursive=True)
+        expected = [node.positionf() for node in T.nodes]
+
+        T = randomTree(300, seed)
+        T.walker(1.0)
+        assert [node.positionf() for node in T.nodes] == expected
+
+def test_no_overlap():
+    # The first walks keep the default ancestor that apportion returns.
+    # Before, the shift of the subtree of 3 was spread from the first
+    # child and moved 2 too little, so 6 was only 0.75 left of 4.
+    T = Tree.fromParentArray([-1, 0, 0, 0, 3, 3, 2])
+    for recursive in (True, False):
+        T.walker(1.0, recursive=recursive)
+        assert [node.positionf() for node in T.nodes] == [(0.0, 0.0), (-1.25, 1.0), (-0.25, 1.0), (1.25, 1.0), (0.75, 2.0), (1.75, 2.0), (-0.25, 2.0)]
+
+    # Nodes on a level are at least distance apart
+    for seed in range(100):
+        T = randomTree(100, seed)
+        T.walker(1.0, recursive=seed % 2 == 0)
+        levels = {}
+        for node in T.nodes:
+            levels.setdefault(node.layout.y(), []).append(node.layout.x())
+        for xs in levels.values():
+            xs.sort()
+            assert all(b - a >= 1.0 - 1e-9 for a, b in zip(xs, xs[1:]))
+
+def test_deep():
+    # A chain that is far deeper than the recursion limit
+    T = Tree("0")
+    node = T.root
+    for i in range(50000):
+        child = Node(str(i + 1))
+        child.parent = node
+        node.children = [child]
+        node = child
+
+    T.walker(1.0)
+
+    node = T.root
+    while node.children:
+        assert node.layout.x() == 0.0
+        node = node.children[0]
+
+def test_graft():
+    # Build a subtree on its own and add it to a tree
+    T = Tree("a1")
+    b = T.addChild("b2")
+    c = T.addChild("c3")
+
+    s = Node("s4")
+    t = s.addChild("t5")
+    u = t.addChild("u6")
+    v = s.addChild("v7")
+
+    assert [node.level() for node in (s, t, u, v)] == [0, 1, 2, 1]
+
+    b.addNode(s)
+
+    assert [node.data for node in T.nodes] == ["a1", "b2", "c3", "s4", "t5", "u6", "v7"]
+    assert [node.level() for node in (s, t, u, v)] == [2, 3, 4, 3]
+    assert all(node.tree is T for node in T.nodes)
+
+    w = u.addChild("w8")
+    assert w.level() == 5
+    assert w in T
+
+    T.walker(1.0)
+
+    nodes = [(node.data,node.positionf()[0],node.positionf()[1]) for node in T.nodes]
+
+    assert isExpected(nodes, [('a1', 0.0, 0.0), ('b2', -0.5, 1.0), ('c3', 0.5, 1.0), ('s4', -0.5, 2.0), ('t5', -1.0, 3.0), ('u6', -1.0, 4.0), ('v7', 0.0, 3.0), ('w8', -1.0, 5.0)])
+
+    # A children list that was assigned before the graft
+    a = Node("x9")
+    a.children = [Node("y10"), Node("z11")]
+    c.addNode(a)
+    T.walker(1.0)
+    assert [node.layout.x() - a.layout.x() for node in a.children] == [-0.5, 0.5]
+
+def test_replace_children():
+    # Replaced children leave the tree, new ones are added to it
+    T = Tree("a")
+    b = T.addChild("b")
+    d = b.addChild("d")
+    c = Node("c")
+    T.root.children = [c]
+    T.walker(1.0)
+    assert T.nodes == [T.root, c]
+    assert list(T.parentIndices()) == [-1, 0]
+    assert list(T.coordinates()) == [0.0, 0.0, 0.0, 1.0]
+    assert b.tree is None and d.tree is None and b.parent is None
+
+    n = Node("n")
+    c.children = [n]
+    T.walker(1.0)
+    assert n.tree is T and n.depth == 2 and len(T) == 3
+    assert list(T.parentIndices()) == [-1, 0, 1]
+    assert list(T.coordinates()) == [0.0, 0.0, 0.0, 1.0, 0.0, 2.0]
+
+    # A list changed in place
+    T.root.children.append(b)
+    T.root.children.remove(c)
+    T.normalize()
+    assert T.nodes == [T.root, b, d]
+    assert list(T.parentIndices()) == [-1, 0, 1]
+
+def test_remove_subtree():
+    # Build a tree
+    T = Tree("a1")
+
+    b = T.addChild("b2")
+    c = T.addChild("c3")
+    d = T.addChild("d4")
+
+    e = c.addChild("e5")
+    f = e.addChild("f6")
+    g = f.addChild("g7")
+    h = d.addChild("h8")
+
+    # Remove a branch, all descendants leave the tree
+    T.removeChild(c)
+    assert [node.data for node in T.nodes] == ["a1", "b2", "d4", "h8"]
+    assert not any(node in T for node in (c, e, f, g))
+    assert c.parent is None and c.children == [e]
+
+    assert d.leftSibling is b
+    assert [node.layout.number for node in T.root.children] == [0, 1]
+
+    # Remove the last and the only child
+    T.removeChild(d)
+    d.removeChild(h)
+    assert [node.data for node in T.nodes] == ["a1", "b2"]
+    assert d.children == []
+
+    # Add the removed branch again
+    b.addNode(c)
+    assert [node.data for node in T.nodes] == ["a1", "b2", "c3", "e5", "f6", "g7"]
+    assert g.level() == 5
+
+    T.walker(1.0)
+
+    nodes = [(node.data,node.position()[0],node.position()[1]) for node in T.nodes]
+
+    assert isExpected(nodes, [('a1', 0, 0), ('b2', 0, 1), ('c3', 0, 2), ('e5', 0, 3), ('f6', 0, 4), ('g7', 0, 5)])
+
+def test_compact():
+    # Build a tree
+    T = CompactTree("a1")
+
+    b = T.addChild(0, "b2")
+    c = T.addChild(0, "c5")
+    d = T.addChild(0, "d6")
+
+    e = T.addChild(b, "e3")
+    f = T.addChild(b, "f4")
+
+    g = T.addChild(d, "g7")
+    h = T.addChild(d, "h10")
+    i = T.addChild(d, "i11")
+
+    j = T.addChild(g, "j8")
+    k = T.addChild(g, "k9")
+
+    l = T.addChild(h, "l12")
+
+    m = T.addChild(i, "m13")
+    n = T.addChild(i, "n14")
+    o = T.addChild(i, "o15")
+    p = T.addChild(i, "p16")
+
+    T.walker(1.0)
+
+    nodes = [(T.data[v],T.positionf(v)[0],T.positionf(v)[1]) for v in range(len(T))]
+
+    assert isExpected(nodes, [('a1', 0.0, 0.0), ('b2', -1.75, 1.0), ('c5', 0.0, 1.0), ('d6', 1.75, 1.0), ('e3', -2.25, 2.0), ('f4', -1.25, 2.0), ('g7', -0.25, 2.0), ('h10', 1.25, 2.0), ('i11', 3.75, 2.0), ('j8', -0.75, 3.0), ('k9', 0.25, 3.0), ('l12', 1.25, 3.0), ('m13', 2.25, 3.0), ('n14', 3.25, 3.0), ('o15', 4.25, 3.0), ('p16', 5.25, 3.0)])
+
+    assert T.children(i) == [m, n, o, p]
+
+def test_compact_same():
+    # CompactTree gives the same coordinates as Tree
+    for seed in range(20):
+        T = randomTree(300, seed)
+        C = CompactTree.fromTree(T)
+        T.walker(0.6)
+        C.walker(0.6)
+        positions = [node.positionf() for node in getNodes_preorder(T, [])]
+        assert [C.positionf(i) for i in range(len(C))] == positions
+
+def test_bulk():
+    expected = [('a1', 0.0, 0.0), ('b2', -1.75, 1.0), ('c5', 0.0, 1.0), ('d6', 1.75, 1.0), ('e3', -2.25, 2.0), ('f4', -1.25, 2.0), ('g7', -0.25, 2.0), ('h10', 1.25, 2.0), ('i11', 3.75, 2.0), ('j8', -0.75, 3.0), ('k9', 0.25, 3.0), ('l12', 1.25, 3.0), ('m13', 2.25, 3.0), ('n14', 3.25, 3.0), ('o15', 4.25, 3.0), ('p16', 5.25, 3.0)]
+
+    data = ["a1", "b2", "c5", "d6", "e3", "f4", "g7", "h10", "i11", "j8", "k9", "l12", "m13", "n14", "o15", "p16"]
+    parents = [-1, 0, 0, 0, 1, 1, 3, 3, 3, 6, 6, 7, 8, 8, 8, 8]
+    edges = [(data[p], data[i]) for i, p in enumerate(parents) if p != -1]
+    # Pairs keep their order on every Python version, dicts only since 3.7
+    nested = [("a1", [("b2", [("e3", None), ("f4", None)]), ("c5", None), ("d6", [("g7", [("j8", None), ("k9", None)]), ("h10", {"l12": None}), ("i11", [("m13", None), ("n14", None), ("o15", None), ("p16", None)])])])]
+
+    for T in (Tree.fromParentArray(parents, data), Tree.fromEdges(edges), Tree.fromNested(nested)):
+        assert T.root.data == "a1"
+        assert len(T) == len(data)
+        assert all(node.tree is T for node in T)
+        assert list(T) == T.nodes
+        assert sorted((node.data, node.level()) for node in T.nodes) == sorted((d, int(y)) for d, x, y in expected)
+
+        T.walker(1.0)
+
+        nodes = [(node.data,node.positionf()[0],node.positionf()[1]) for node in T.nodes]
+
+        assert isExpected(nodes, expected)
+
+    assert [node.data for node in Tree.fromParentArray(parents).nodes] == list(range(len(parents)))
+
+    for parents in ([0, -1, 1, 5], [-1, 0, -1], [1, 0]):
+        try:
+            Tree.fromParentArray(parents)
+        except (ValueError, IndexError):
+            pass
+        else:
+            assert False, parents
+
+def test_incremental():
+    # Edit random trees and compare with a layout from scratch
+    for seed in range(30):
+        rnd = random.Random(seed)
+        T = randomTree(rnd.randint(1, 80), seed)
+        T.walker(0.6, incremental=True)
+        removed = []
+        for step in range(8):
+            for k in range(rnd.randint(1, 4)):
+                nodes = T.nodes
+                r = rnd.random()
+                if r < 0.5:
+                    rnd.choice(nodes).addChild("x")
+                elif r < 0.8 and len(nodes) > 1:
+                    v = rnd.choice(nodes[1:])
+                    removed.append(v.parent.removeChild(v))
+                elif removed:
+                    rnd.choice(nodes).addNode(removed.pop())
+
+            T.walker(0.6, incremental=True)
+
+            allnodes = getNodes_preorder(T, [])
+            index = dict((node, i) for i, node in enumerate(allnodes))
+            parents = [index[node.parent] if node.parent else -1 for node in allnodes]
+            expected = Tree.fromParentArray(parents)
+            expected.walker(0.6)
+            positions = [node.positionf() for node in getNodes_preorder(expected, [])]
+
+            assert [node.positionf() for node in allnodes] == positions
+
+def test_coordinates():
+    import treedraw
+    T = randomTree(200, 1)
+    T.walker(0.6)
+    C = CompactTree.fromTree(T)
+    C.walker(0.6)
+    expected = [c for node in T.nodes for c in node.positionf((3.0, 4.0), 10.0, 20.0)]
+    compact = [c for node in getNodes_preorder(T, []) for c in node.positionf((3.0, 4.0), 10.0, 20.0)]
+
+    numpy = treedraw.numpy
+    try:
+        for treedraw.numpy in (numpy, None):
+            assert list(T.coordinates((3.0, 4.0), 10.0, 20.0)) == expected
+            assert list(T.coordinates((3.0, 4.0), (10.0, 20.0))) == expected
+            assert list(C.coordinates((3.0, 4.0), 10.0, 20.0)) == compact
+    finally:
+        treedraw.numpy = numpy
+
+    nodes = T.nodes
+    parents = T.parentIndices()
+    assert len(parents) == len(nodes)
+    assert parents[0] == -1
+    assert all(nodes[p] is node.parent for node, p in zip(nodes[1:], parents[1:]))
+
+def test_width():
+    T = Tree("a1")
+
+    b = T.addChild("b2", 2.0)
+    c = T.addChild("c3", 4.0)
+
+    d = b.addChild("d4", 1.0)
+    e = b.addChild("e5", 3.0)
+    f = c.addChild("f6", 5.0)
+
+    T.walker(1.0, subtreeDistance=2.0)
+
+    nodes = [(node.data,node.positionf()[0],node.positionf()[1]) for node in T.nodes]
+
+    # Siblings are 1.0 apart, the neighbouring subtrees 2.0
+    assert isExpected(nodes, [('a1', 0.0, 0.0), ('b2', -3.75, 1.0), ('c3', 3.75, 1.0), ('d4', -5.25, 2.0), ('e5', -2.25, 2.0), ('f6', 3.75, 2.0)])
+
+    # Without widths and subtreeDistance the layout does not change
+    U = Tree.fromParentArray([-1, 0, 0, 1, 1, 2])
+    U.walker(1.0)
+    V = Tree.fromParentArray([-1, 0, 0, 1, 1, 2])
+    V.walker(1.0, subtreeDistance=1.0)
+    assert [node.positionf() for node in U.nodes] == [node.positionf() for node in V.nodes] == [(0.0, 0.0), (-0.75, 1.0), (0.75, 1.0), (-1.25, 2.0), (-0.25, 2.0), (0.75, 2.0)]
+
+    # Random widths, the compact tree gives the same coordinates
+    for seed in range(10):
+        rnd = random.Random(seed)
+        T = randomTree(200, seed)
+        for node in T.nodes:
+            node.setSize(rnd.random() * 3.0, 1.0)
+        C = CompactTree.fromTree(T)
+        T.walker(0.5, subtreeDistance=1.5)
+        C.walker(0.5, subtreeDistance=1.5)
+        nodes = getNodes_preorder(T, [])
+        assert [C.positionf(i)[0] for i in range(len(C))] == [node.layout.x() for node in nodes]
+        # The levels are 1.0 apart plus the heights
+        assert [2.0 * C.y(i) for i in range(len(C))] == [node.layout.y() for node in nodes]
+
+        # No overlaps on a level
+        levels = {}
+        for node in T.nodes:
+            levels.setdefault(node.level(), []).append((node.layout.x(), node.width))
+        for level in levels.values():
+            level.sort()
+            for (x0, w0), (x1, w1) in zip(level, level[1:]):
+                assert x1 - x0 >= 0.5 * (w0 + w1) + 0.5 - 1e-9
+
+def test_stream():
+    T = randomTree(100, 2)
+    T.nodes[7].setSize(2.0)
+    T.walker(0.5)
+    expected = [(node, node.layout.x(), node.layout.y()) for node in getNodes_preorder(T, [])]
+
+    for i in range(2):
+        assert list(T.iterLayout(0.5)) == expected
+
+    f = StringIO()
+    T.writeJSONLines(f, 0.5, scalex=10.0)
+    lines = [json.loads(line) for line in f.getvalue().splitlines()]
+    assert [(d["data"], d["x"], d["y"]) for d in lines] == [(node.data, 10.0 * x, 10.0 * y) for node, x, y in expected]
+    assert [d["parent"] for d in lines[1:]] == [lines.index(next(d for d in lines if d["data"] == node.parent.data)) for node, x, y in expected[1:]]
+
+    f = StringIO()
+    T.writeDOT(f, 0.5)
+    dot = f.getvalue()
+    assert dot.startswith("digraph {") and dot.count(" -> ") == len(T) - 1
+
+    # Only quotes and backslashes are escaped
+    f = StringIO()
+    Tree(u"\u00e4").writeDOT(f, label=lambda data: data + u' "q" \\')
+    assert u'label="\u00e4 \\"q\\" \\\\"' in f.getvalue()
+
+    f = StringIO()
+    T.writeSVG(f, 0.5, scalex=20.0, scaley=30.0, radius=5.0)
+    svg = ET.fromstring(f.getvalue())
+    left, top, width, height = [float(v) for v in svg.get("viewBox").split()]
+    shapes = svg.findall(".//{http://www.w3.org/2000/svg}circle")
+    assert len(shapes) == len(T) - 1
+    assert len(svg.findall(".//{http://www.w3.org/2000/svg}rect")) == 1
+    assert len(svg.findall(".//{http://www.w3.org/2000/svg}line")) == len(T) - 1
+    for circle in shapes:
+        x = float(circle.get("cx"))
+        y = float(circle.get("cy"))
+        assert left + 5.0 <= x <= left + width - 5.0
+        assert top + 5.0 <= y <= top + height - 5.0
+    rect = svg.find(".//{http://www.w3.org/2000/svg}rect")
+    assert min([float(circle.get("cx")) for circle in shapes] + [float(rect.get("x"))]) == left + 10.0
+
+def test_cache():
+    def build(seed):
+        # Random tree with some copies of the same subtree
+        T = randomTree(100, seed)
+        T.nodes[3].setSize(1.0)
+        for node in T.nodes[::10]:
+            for i in range(3):
+                child = node.addChild("c")
+                child.addChild("a").addChild("b")
+                child.addChild("a", width=0.5)
+        return T
+
+    cache = LayoutCache(10)
+    for seed in range(20):
+        T = build(seed)
+        T.walker(1.0, subtreeDistance=2.0)
+        expected = list(T.coordinates())
+        T = build(seed)
+        T.walker(1.0, subtreeDistance=2.0, cache=cache)
+        assert list(T.coordinates()) == expected
+    assert cache.hits > 0 and cache.nodes > 0
+    assert len(cache) <= 10
+
+    try:
+        T.walker(1.0, incremental=True, cache=cache)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_parallel():
+    for seed in range(3):
+        T = randomTree(300, seed)
+        T.nodes[5].setSize(1.5)
+        T.walker(1.0, subtreeDistance=2.0)
+        expected = list(T.coordinates())
+        T = randomTree(300, seed)
+        T.nodes[5].setSize(1.5)
+        T.walker(1.0, subtreeDistance=2.0, workers=2)
+        assert list(T.coordinates()) == expected
+
+    T = Tree("a")
+    T.walker(1.0, workers=2)
+    assert T.root.layout.x() == 0
+
+    # Split below the children of the root, two chains where the part above gets too large
+    for parents in ([-1] + [(i - 1) // 2 for i in range(1, 2000)], [-1, 0, 0] + list(range(1, 400))):
+        T = Tree.fromParentArray(parents)
+        T.walker(1.0)
+        expected = T.coordinates()
+        T.normalize()
+        T.walker(1.0, workers=3)
+        assert T.coordinates() == expected
+
+    # The columns built from the parent indices match addChild()
+    parents = [-1, 0, 0, 1, 1, 1, 2, 6]
+    C = CompactTree(None, 1.0)
+    for i in range(1, len(parents)):
+        C.addChild(parents[i], None, float(i))
+    D = CompactTree._fromParents(parents, [1.0] + [float(i) for i in range(1, len(parents))])
+    for column in ("parent", "firstChild", "lastChild", "nextSibling", "leftSibling", "number", "depth", "width"):
+        assert getattr(D, column) == getattr(C, column)
+
+    closePools()
+    T.walker(1.0, workers=3)
+    assert T.coordinates() == expected
+    closePools()
+
+def test_forest():
+    # A tree that is wide on its second level, a chain and a single node
+    parents = [-1, 0, 1, 1, 1, -1, 5, -1]
+    F = Forest.fromParentArray(parents)
+    assert len(F) == 3
+    assert list(F.treeIndices()) == [0, 5, 7, 8]
+    assert list(F.parentIndices()) == parents
+
+    F.walker(1.0)
+    xy = F.coordinates()
+    assert list(xy[0::2]) == [0.0, 0.0, -1.0, 0.0, 1.0, 2.0, 2.0, 3.0]
+    assert list(xy[1::2]) == [0, 1, 2, 2, 2, 0, 1, 0]
+
+    # The contours allow the chain to move next to the narrow levels
+    F = Forest.fromParentArray(parents)
+    F.walker(1.0, pack=True)
+    xy = F.coordinates()
+    assert list(xy[0::2]) == [0.0, 0.0, -1.0, 0.0, 1.0, 1.0, 1.0, 2.0]
+
+    F = Forest([Tree("a"), randomTree(50, 1)])
+    F.walker(1.0, treeDistance=3.0)
+    T = randomTree(50, 1)
+    T.walker(1.0)
+    offset = F.trees[1].root.layout.x() - T.root.layout.x()
+    assert [node.layout.x() for node in F.trees[1].nodes] == [node.layout.x() + offset for node in T.nodes]
+    assert min(F.coordinates()[2::2]) == 3.0
+
+    try:
+        Forest.fromParentArray([-1, 2, 1])
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_collapsed():
+    T = randomTree(200, 4)
+    T.walker(1.0, incremental=True)
+    rnd = random.Random(4)
+    for step in range(10):
+        node = rnd.choice(T.nodes)
+        node.collapsed = not node.collapsed
+        T.walker(1.0, incremental=True)
+
+        # Same layout as a tree without the hidden subtrees
+        U = randomTree(200, 4)
+        hidden = set()
+        for node, copy in zip(T.nodes, U.nodes):
+            if node.collapsed:
+                hidden.update(copy.children)
+        for node in list(U.nodes):
+            if node in hidden and node.tree is U:
+                node.parent.removeChild(node)
+        U.walker(1.0)
+        visible = T.nodesInRect(-1000, 0, 1000, 1000)
+        assert len(visible) == len(U)
+        assert sorted(node.positionf() for node in visible) == sorted(node.positionf() for node in U.nodes)
+
+        # Viewport query
+        x0 = rnd.uniform(-10, 5)
+        y0 = rnd.uniform(-1, 5)
+        result = T.nodesInRect(x0, y0, x0 + 5, y0 + 3)
+        assert sorted(map(id, result)) == sorted(id(node) for node in visible if x0 <= node.layout.x() <= x0 + 5 and y0 <= node.layout.y() <= y0 + 3)
+
+    # Hidden nodes are exported as NaN, laid out before or not
+    T = Tree("a")
+    b = T.addChild("b")
+    d = b.addChild("d")
+    T.addChild("e")
+    T.walker(1.0)
+    b.collapsed = True
+    c = b.addChild("c")
+    T.walker(1.0)
+    for xy in (T.coordinates(), T.edges(), T.edges("elbow"), Forest([T]).coordinates()):
+        assert not any(v != v for v in xy[:4])
+    xy = T.coordinates()
+    assert [v != v for v in xy] == [False, False, False, False, True, True, False, False, True, True]
+    edges = T.edges()
+    assert all(v != v for v in edges[6:8]) and all(v != v for v in edges[14:16])
+    assert list(edges[8:12]) == [0.0, 0.0, 0.5, 1.0]
+
+def test_nodeat():
+    T = randomTree(300, 6)
+    T.nodes[10].setSize(3.0, 0.5)
+    T.walker(1.0)
+    origin = (400.0, 20.0)
+    for node in T.nodes:
+        x, y = node.positionf(origin, 50, 80)
+        assert T.nodeAt(x + 10, y - 10, origin, 50, 80, 15) is node
+        assert T.nodeAt(x, y + 40, origin, 50, 80, 15) is None
+    x, y = T.nodes[10].positionf(origin, 50, 80)
+    assert T.nodeAt(x + 70, y + 19, origin, 50, 80, 15) is T.nodes[10]
+    assert T.nodeAt(-1000, 0, origin, 50, 80, 15) is None
+
+    # Changes after the walk update the index
+    T = Tree("a")
+    b = T.addChild("b")
+    T.addChild("c")
+    T.walker(1.0)
+    assert T.nodeAt(-0.5, 1.0) is b
+    T.removeChild(b)
+    assert T.nodeAt(-0.5, 1.0) is None and b not in T.nodesInRect(-2, 0, 2, 2)
+    x = T.addChild("x")
+    assert T.nodeAt(0.5, 1.0).data == "c" and x not in T.nodesInRect(-2, 0, 2, 2)
+    T.walker(1.0)
+    assert T.nodeAt(0.5, 1.0) is x
+
+    rnd = random.Random(6)
+    for i in range(20):
+        x0 = rnd.uniform(0, 800)
+        y0 = rnd.uniform(0, 600)
+        result = T.nodesInRect(x0, y0, x0 - 200, y0 + 150, origin, 50, 80)
+        positions = [(node, node.positionf(origin, 50, 80)) for node in T.nodes]
+        assert sorted(map(id, result)) == sorted(id(node) for node, (x, y) in positions if x0 - 200 <= x <= x0 and y0 <= y <= y0 + 150)
+
+def test_stats():
+    T = randomTree(200, 7)
+    assert T.walker(1.0) is None
+    expected = [node.positionf() for node in T.nodes]
+
+    T = randomTree(200, 7)
+    stats = T.walker(1.0, stats=True)
+    assert [node.positionf() for node in T.nodes] == expected
+    assert stats.nodes == 200
+    assert stats.maxDepth == max(node.level() for node in T.nodes)
+    assert stats.moveSubtrees > 0 and stats.contourSteps > 0
+    assert set(stats.timings) == set(["firstWalk", "secondWalk", "total"])
+    assert "_moveSubtree" not in T.__dict__
+    assert json.loads(json.dumps(stats.asDict()))["nodes"] == 200
+
+    # A chain of leaves on the last level: one step per sibling pair
+    T = Tree("a")
+    for i in range(3):
+        T.addChild(str(i)).addChild("x")
+    assert T.walker(1.0, stats=True).contourSteps == 2
+    stats = T.walker(1.0, incremental=True, stats=True)
+    assert set(stats.timings) == set(["incrementalWalk", "total"])
+
+def test_reorder():
+    # Children lists filled directly are linked by the next walk
+    T = Tree("a")
+    children = [Node(str(i)) for i in range(1000)]
+    T.root.children = children
+    T.walker(1.0)
+    assert [node.leftSibling for node in children[1:]] == children[:-1]
+    assert [node.layout.number for node in children] == list(range(1000))
+    assert [node.layout.x() for node in children] == [i - 499.5 for i in range(1000)]
+
+    # Insert and move keep them up to date, also for incremental walks
+    rnd = random.Random(8)
+    T = randomTree(100, 8)
+    T.walker(1.0, incremental=True)
+    for step in range(30):
+        node = rnd.choice(T.nodes)
+        if node.children and step % 2:
+            node.moveChild(rnd.choice(node.children), rnd.randrange(-3, len(node.children) + 3))
+        else:
+            node.insertChild(rnd.randrange(-3, len(node.children) + 3), str(step))
+        for v in T.nodes:
+            assert [w.layout.number for w in v.children] == list(range(len(v.children)))
+            assert [w.leftSibling for w in v.children] == ([None] + v.children[:-1] if v.children else [])
+        T.walker(1.0, incremental=True)
+        # Same layout as a new tree with children sorted in place
+        nodes = T.nodes
+        U = Tree.fromParentArray([nodes.index(v.parent) if v.parent else -1 for v in nodes])
+        for u in U.nodes:
+            u.children.sort(key=lambda w: nodes[w.data].layout.number)
+        U.normalize()
+        U.walker(1.0)
+        assert [v.layout.x() for v in T.nodes] == [u.layout.x() for u in U.nodes]
+
+def test_snapshot():
+    T = randomTree(300, 9)
+    T.nodes[4].setSize(2.0, 0.5)
+    T.nodes[5].data = {"label": u"\u00e4", "id": 5}
+    T.walker(1.0)
+    fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            T.writeSnapshot(f)
+        with LayoutSnapshot(path) as S:
+            assert len(S) == 300
+            assert S.coordinates((1, 2), 3, 4) == T.coordinates((1, 2), 3, 4)
+            assert S.parentIndices() == T.parentIndices()
+            assert S.data(5) == {"label": u"\u00e4", "id": 5}
+            assert S.data(299) == "299"
+            assert S.size(4) == (2.0, 0.5)
+            assert S.positionf(7, (1, 2), 3) == T.nodes[7].positionf((1, 2), 3)
+            assert S.parent(0) == -1
+            U = S.toTree()
+        assert [node.positionf() for node in U.nodes] == [node.positionf() for node in T.nodes]
+        assert [node.width for node in U.nodes] == [node.width for node in T.nodes]
+        U.walker(1.0)
+        assert U.coordinates() == T.coordinates()
+        with open(path, "rb") as f:
+            with LayoutSnapshot(f) as S:
+                assert S.x(7) == T.nodes[7].layout.x()
+                try:
+                    S.x(300)
+                except IndexError:
+                    pass
+                else:
+                    assert False
+    finally:
+        os.remove(path)
+
+    # Children in another order than the nodes were added
+    T = Tree("a")
+    b = T.addChild("b")
+    T.insertChild(0, "c")
+    d = b.addChild("d")
+    b.addChild("e")
+    b.moveChild(d, 1)
+    T.walker(1.0)
+    f = io.BytesIO()
+    T.writeSnapshot(f)
+    fd, path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, "wb") as g:
+            g.write(f.getvalue())
+        with LayoutSnapshot(path) as S:
+            U = S.toTree()
+    finally:
+        os.remove(path)
+    assert [v.data for v in U.root.children] == ["c", "b"]
+    assert [v.data for v in U.root.children[1].children] == ["e", "d"]
+    U.walker(1.0)
+    assert U.coordinates() == T.coordinates()
+
+    # The orientation is saved with the layout
+    T = randomTree(100, 3)
+    for orientation in ("left", "radial"):
+        T.walker(1.0, orientation=orientation)
+        f = io.BytesIO()
+        T.writeSnapshot(f)
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, "wb") as g:
+                g.write(f.getvalue())
+            with LayoutSnapshot(path) as S:
+                assert S.orientation == orientation
+                assert S.coordinates((1, 2), 3) == T.coordinates((1, 2), 3)
+                assert S.positionf(7) == T.nodes[7].positionf()
+                assert S.x(7) == T.nodes[7].layout.x()
+                U = S.toTree()
+        finally:
+            os.remove(path)
+        assert U.coordinates() == T.coordinates()
+
+def test_edges():
+    T = Tree("a")
+    b = T.addChild("b")
+    c = b.addChild("c")
+    T.addChild("d")
+    T.walker(1.0)
+    assert list(T.edges()) == [0.0, 0.0, -0.5, 1.0, -0.5, 1.0, -0.5, 2.0, 0.0, 0.0, 0.5, 1.0]
+    assert list(T.edges("elbow", (10, 20), 2, 10)[:8]) == [10.0, 20.0, 10.0, 25.0, 9.0, 25.0, 9.0, 30.0]
+    assert T.edges("spline") == T.edges("elbow")
+
+    T = randomTree(200, 10)
+    T.walker(1.0)
+    edges = T.edges("straight", (5, 6), 7, 8)
+    expected = []
+    for node in T.nodes[1:]:
+        expected.extend(node.parent.positionf((5, 6), 7, 8) + node.positionf((5, 6), 7, 8))
+    assert list(edges) == expected
+
+    try:
+        T.edges("curved")
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_async():
+    if asyncio is None:
+        return
+    T = randomTree(500, 11)
+    T.walker(1.0)
+    expected = T.coordinates()
+
+    T = randomTree(500, 11)
+    walks = []
+    walker = T.walker
+    T.walker = lambda *args, **kwargs: walks.append(args) or walker(*args, **kwargs)
+    loop = asyncio.new_event_loop()
+    try:
+        # Concurrent requests share one layout
+        results = loop.run_until_complete(asyncio.gather(*[T.walkerAsync(1.0, loop=loop) for i in range(5)]))
+        assert len(walks) == 1
+        assert all(xy == expected for xy in results)
+        assert results[0] is not results[1]
+
+        # Cached until the tree changes
+        assert loop.run_until_complete(T.walkerAsync(1.0, loop=loop)) == expected
+        assert len(walks) == 1
+        loop.run_until_complete(T.walkerAsync(2.0, loop=loop))
+        assert len(walks) == 2
+        T.nodes[3].addChild("new")
+        xy = loop.run_until_complete(T.walkerAsync(1.0, loop=loop))
+        assert len(walks) == 3 and len(xy) == 2 * 501
+
+        # The orientation of the last walk is kept and part of the cache key
+        T.walker(1.0, orientation="left")
+        left = T.coordinates()
+        assert loop.run_until_complete(T.walkerAsync(1.0, loop=loop)) == left
+        assert T._orientation == "left"
+        top = loop.run_until_complete(T.walkerAsync(1.0, loop=loop, orientation="top"))
+        assert list(top[0::2]) == list(left[1::2]) and list(top[1::2]) == list(left[0::2])
+
+        # Without loop the running loop is used
+        requests = []
+        loop.call_soon(lambda: requests.append(T.walkerAsync(3.0)))
+        loop.run_until_complete(asyncio.sleep(0))
+        T.walker(3.0, orientation="left")
+        assert loop.run_until_complete(requests[0]) == T.coordinates()
+    finally:
+        loop.close()
+
+def test_rescale():
+    T = randomTree(300, 12)
+    T.walker(1.0, subtreeDistance=2.0)
+    for distance in (0.5, 3.0, 1.0):
+        stats = T.walker(distance, subtreeDistance=2.0 * distance, stats=True)
+        assert "rescale" in stats.timings
+        U = randomTree(300, 12)
+        U.walker(distance, subtreeDistance=2.0 * distance)
+        for a, b in zip(T.coordinates(), U.coordinates()):
+            assert abs(a - b) < 1e-9
+
+    # A new ratio, a change of the tree or a width need a new walk
+    assert "rescale" not in T.walker(1.0, subtreeDistance=1.0, stats=True).timings
+    T.nodes[5].addChild("new")
+    assert "rescale" not in T.walker(2.0, subtreeDistance=2.0, stats=True).timings
+    T.nodes[5].setSize(1.0)
+    T.walker(1.0)
+    assert "rescale" not in T.walker(2.0, stats=True).timings
+
+    # Lists reordered in place and the size of the root are changes too
+    T = Tree("a")
+    b = T.addChild("b")
+    d = T.addChild("d")
+    T.walker(1.0)
+    T.root.children.reverse()
+    T.normalize()
+    T.walker(1.0)
+    assert (b.layout.x(), d.layout.x()) == (0.5, -0.5)
+    T.root.setSize(0, 4)
+    T.walker(1.0)
+    assert b.layout.y() == 3.0
+
+def test_repeated():
+    # Nothing is left from earlier walks with other distances
+    def build():
+        T = randomTree(300, 13)
+        for node in T.nodes[7::11]:
+            node.setSize(0.5)
+        return T
+
+    U = build()
+    U.walker(1.0, subtreeDistance=1.5)
+    expected = U.coordinates()
+    for kwargs in ({}, {"recursive": True}, {"cache": LayoutCache()}):
+        T = build()
+        T.walker(1.0)
+        T.walker(2.0, subtreeDistance=0.5)
+        T.walker(1.0, subtreeDistance=1.5, **kwargs)
+        assert T.coordinates() == expected
+        T.walker(1.0, subtreeDistance=1.5, **kwargs)
+        assert T.coordinates() == expected
+
+def test_orientation():
+    import math
+    T = randomTree(200, 14)
+    T.walker(1.0)
+    top = T.coordinates()
+    for orientation in ("bottom", "left", "right", "radial"):
+        T.walker(1.0, orientation=orientation)
+        xy = T.coordinates((3, 4), 2, 5)
+        for i, node in enumerate(T.nodes):
+            x, y = top[2 * i], top[2 * i + 1]
+            if orientation == "bottom":
+                expected = (x, -y)
+            elif orientation == "left":
+                expected = (y, x)
+            elif orientation == "right":
+                expected = (-y, x)
+            else:
+                assert abs(math.hypot(*node.positionf()) - y) < 1e-9
+                expected = node.positionf()
+            assert abs(node.positionf()[0] - expected[0]) < 1e-9
+            assert abs(node.positionf()[1] - expected[1]) < 1e-9
+            assert abs(xy[2 * i] - (3 + 2 * expected[0])) < 1e-9
+            assert abs(xy[2 * i + 1] - (4 + 5 * expected[1])) < 1e-9
+        # Queries work in the orientation
+        for node in T.nodes[::17]:
+            x, y = node.positionf((3, 4), 2, 5)
+            assert T.nodeAt(x, y, (3, 4), 2, 5) is node
+            assert node in T.nodesInRect(x - 0.1, y - 0.1, x + 0.1, y + 0.1, (3, 4), 2, 5)
+        edges = T.edges("elbow")
+        assert (edges[0], edges[1]) == T.root.positionf()
+
+    # Clicks on both sides of the angle 0 in the radial orientation
+    U = Tree("a")
+    b = U.addChild("b")
+    U.addChild("c")
+    U.addChild("d")
+    U.walker(1.0, orientation="radial")
+    assert b.positionf((0, 0), 100) == (100.0, 0.0)
+    assert U.nodeAt(100, 3, (0, 0), 100, 100, 15) is b
+    assert U.nodeAt(100, -3, (0, 0), 100, 100, 15) is b
+
+    T.walker(1.0)
+    assert T.coordinates() == top
+
+    # Forest and iterLayout() lay out top down
+    T.walker(1.0, orientation="left")
+    Forest([T]).walker(1.0)
+    assert T.coordinates() == top
+    T.walker(1.0, orientation="left")
+    list(T.iterLayout(1.0))
+    assert T.coordinates() == top
+    try:
+        T.walker(1.0, orientation="up")
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_heights():
+    T = Tree("a")
+    b = T.addChild("b")
+    c = b.addChild("c")
+    d = T.addChild("d")
+    e = c.addChild("e")
+    c.setSize(0.0, 3.0)
+    d.setSize(0.0, 1.0)
+    for kwargs in ({}, {"recursive": True}, {"incremental": True}):
+        T.walker(1.0, **kwargs)
+        # Each level is 1.0 below the last plus half of the highest nodes
+        assert [v.layout.y() for v in (T.root, b, c, d, e)] == [0.0, 1.5, 4.5, 1.5, 7.0]
+    assert [y for node, x, y, i, parent in T._iterLayout(1.0, None)] == [0.0, 1.5, 4.5, 7.0, 1.5]
+
+    # An incremental walk moves all levels below a new height
+    d.setSize(0.0, 3.0)
+    T.walker(1.0, incremental=True)
+    assert [v.layout.y() for v in (T.root, b, c, d, e)] == [0.0, 2.5, 6.5, 2.5, 9.0]
+    d.setSize(0.0, 0.0)
+    c.setSize(0.0, 0.0)
+    T.walker(1.0, incremental=True)
+    assert [v.layout.y() for v in (T.root, b, c, d, e)] == [0, 1, 2, 1, 3]
+
+    # Collapsed nodes hide their heights
+    c.setSize(0.0, 3.0)
+    b.collapsed = True
+    T.walker(1.0)
+    assert [v.layout.y() for v in (T.root, b, d)] == [0, 1, 1]
+
+    # The SVG edges start at the parent and the image ends at the last level
+    T = Tree("a")
+    b = T.addChild("b")
+    b.setSize(0, 4)
+    b.addChild("c")
+    f = StringIO()
+    T.writeSVG(f, scalex=10.0, radius=1.0)
+    svg = ET.fromstring(f.getvalue())
+    lines = svg.findall(".//{http://www.w3.org/2000/svg}line")
+    assert [(float(line.get("y1")), float(line.get("y2"))) for line in lines] == [(1.0, 29.0), (31.0, 59.0)]
+    assert float(svg.get("viewBox").split()[3]) == 64.0
+
 def noDuplicatePostions(nodes):
     return len(set(nodes)) == len(nodes)
 
@@ -249,6 +1169,15 @@ def getNodes_preorder(tree, nodes = []):
         getNodes_preorder(child, nodes)
     return nodes
 
+def randomTree(n, seed):
+    # Attach each new node to a random existing node
+    rnd = random.Random(seed)
+    T = Tree("0")
+    nodes = [T.root]
+    for i in range(1, n):
+        nodes.append(rnd.choice(nodes).addChild(str(i)))
+    return T
+
 def run_all():
     for fname, f in list(globals().items()):
         if fname.startswith('test_'):
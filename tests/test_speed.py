@@ -3,8 +3,6 @@ import timeit
 import sys
 import numpy as np
 
-sys.setrecursionlimit(10000)
-
 try:
     from treedraw import Tree
 except ImportError:
@@ -28,6 +26,10 @@ def _setup(i):
         T.append(_randomTree(N[i], 5, 10))
 
 
+def _setup_build(i):
+    random.seed(i)
+
+
 def _randomTree(N, minPerLevel=3, maxPerLevel=5):
     if maxPerLevel <= minPerLevel:
         raise ValueError("Expected: maxPerLevel > minPerLevel")
@@ -46,33 +48,39 @@ def _randomTree(N, minPerLevel=3, maxPerLevel=5):
     return T
 
 def _randomChildren(node, minPerLevel, maxPerLevel, counter):
-    children = []
-    for j in range(minPerLevel, random.randint(minPerLevel+1, maxPerLevel)):
-        child = node.addChild("%.0f" % (random.random()*100))
-        children.append(child)
+    # Depth first, with an explicit stack because the trees get very deep
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        children = []
+        for j in range(minPerLevel, random.randint(minPerLevel+1, maxPerLevel)):
+            child = node.addChild("%.0f" % (random.random()*100))
+            children.append(child)
 
-        counter[0] += 1
-        if counter[0] == counter[1]:
-            return
+            counter[0] += 1
+            if counter[0] == counter[1]:
+                return
 
-    for child in children:
-        _randomChildren(child, minPerLevel=minPerLevel, maxPerLevel=maxPerLevel, counter=counter)
-        if counter[0] == counter[1]:
-            return
+        stack.extend(reversed(children))
 
 
 def _run_speed(i):
     T.pop().walker(1.0)
 
-def test_linear():
+def _run_build(i):
+    _randomTree(N[i], 5, 10)
+
+def _measure(run, setup):
     times = {}
     print("Running each test %d times with random data" % NUMBER)
     for i, n in enumerate(N):
         print("n=%d nodes:" % n)
-        t = timeit.timeit('test_speed._run_speed(%d)' % i, setup='import test_speed; test_speed._setup(%d)' % i, number=NUMBER)
+        t = timeit.timeit('test_speed.%s(%d)' % (run, i), setup='import test_speed; test_speed.%s(%d)' % (setup, i), number=NUMBER)
         times[n] = t
         print("{0:25.20f}".format(t))
+    return times
 
+def _check_linear(times):
     x = list(times.keys())
     y = list(times.values())
     a = np.vstack([x, np.ones(len(x))]).T
@@ -84,7 +92,16 @@ def test_linear():
         print("Times seem to be not linear:")
         print(r, res)
 
+def test_linear():
+    # Layout only, the trees are built in the setup
+    _check_linear(_measure('_run_speed', '_setup'))
+
+def test_linear_build():
+    # Tree construction with addChild only
+    _check_linear(_measure('_run_build', '_setup_build'))
+
 if __name__ == '__main__':
     test_linear()
+    test_linear_build()
 
 
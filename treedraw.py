@@ -11,6 +11,8 @@ Each node in the tree has a layout property that contains an x and y
 coordinate.
 The layout is calculated by calling the method "walker(distance)".
 The distance property indicated the distance between nodes on the same level.
+Nodes can have a width, then the distance is the gap between the borders of
+the nodes instead of their centers.
 If the tree is build up using the addChild/removeChild methods, the layout
 will be calculated in linear time.
 The algoithm is a python implemenation of this publication
@@ -19,11 +21,22 @@ Walker's Algorithm to Run in Linear Time"</a> by Christoph Buchheim, Michael
 Junger, Sebastian Leipert"
 """
 
-__all__ = ["Tree", "Node"]
+__all__ = ["Tree", "Node", "CompactTree", "LayoutCache", "LayoutStats",
+           "Forest", "LayoutSnapshot", "closePools"]
 
 __version__ = "1.4"
 
+import json
 import math
+import mmap
+import multiprocessing
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from timeit import default_timer
+from xml.sax.saxutils import escape
 
 try:
     xrange(5)
@@ -31,70 +44,1434 @@ try:
 except NameError:
     myrange = range
 
+try:
+    from collections import OrderedDict
+except ImportError:  # Python 2.6
+    OrderedDict = dict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import asyncio
+except ImportError:  # Python 2
+    asyncio = None
+
+
+def _scales(scalex, scaley):
+    # Arguments of position(): scalex, scalex and scaley, or (scalex, scaley)
+    if scaley is None:
+        if hasattr(scalex, "__getitem__"):
+            return scalex[0], scalex[1]
+        return scalex, scalex
+    return scalex, scaley
+
+
+def _transform(xy, origin, scalex, scaley):
+    # Scale and move the interleaved coordinates x0, y0, x1, y1, ... of an
+    # array("d") in place
+    scalex, scaley = _scales(scalex, scaley)
+    if numpy is not None:
+        a = numpy.frombuffer(xy, dtype=numpy.float64).reshape(-1, 2)
+        a *= (scalex, scaley)
+        a += origin
+    else:
+        ox, oy = origin
+        xy[0::2] = array("d", [ox + (x * scalex) for x in xy[0::2]])
+        xy[1::2] = array("d", [oy + (y * scaley) for y in xy[1::2]])
+    return xy
+
+
+def _oriented(x, y, orientation, radial):
+    # Position in the orientation from the top down position, radial is
+    # (left, span) of the radial orientation
+    if orientation == "top":
+        return x, y
+    elif orientation == "bottom":
+        return x, -y
+    elif orientation == "left":
+        return y, x
+    elif orientation == "right":
+        return -y, x
+    left, span = radial
+    a = 2.0 * math.pi * (x - left) / span
+    return y * math.cos(a), y * math.sin(a)
+
+
+def _orientedArray(xy, orientation, radial):
+    # _oriented() for the interleaved positions of an array("d") in place
+    if orientation == "top":
+        return xy
+    if numpy is not None:
+        a = numpy.frombuffer(xy, dtype=numpy.float64).reshape(-1, 2)
+        x = a[:, 0].copy()
+        y = a[:, 1].copy()
+        if orientation == "bottom":
+            a[:, 1] = -y
+        elif orientation == "left":
+            a[:, 0] = y
+            a[:, 1] = x
+        elif orientation == "right":
+            a[:, 0] = -y
+            a[:, 1] = x
+        else:
+            left, span = radial
+            angle = (2.0 * math.pi / span) * (x - left)
+            a[:, 0] = y * numpy.cos(angle)
+            a[:, 1] = y * numpy.sin(angle)
+    else:
+        points = [_oriented(x, y, orientation, radial)
+                  for x, y in zip(xy[0::2], xy[1::2])]
+        xy[0::2] = array("d", [p[0] for p in points])
+        xy[1::2] = array("d", [p[1] for p in points])
+    return xy
+
 
-class Tree:
+def _restore(nodes, prelims, mods, threads):
+    # Set the result of a first walk, the threads are indices into nodes
+    for w, prelim, mod, thread in zip(nodes, prelims, mods, threads):
+        layout = w.layout
+        layout.prelim = prelim
+        layout.mod = mod
+        layout.thread = nodes[thread] if thread != -1 else None
+        layout.ancestor = w
+        layout.shift = 0
+        layout.change = 0
+
+
+def _future(loop):
+    # loop.create_future() is missing before Python 3.5.2
+    if hasattr(loop, "create_future"):
+        return loop.create_future()
+    return asyncio.Future(loop=loop)
+
+
+_pools = {}
+
+
+def _pool(workers):
+    # Process pool of Tree.walker(workers=n), kept for the next walks
+    pool = _pools.get(workers)
+    if pool is None:
+        pool = _pools[workers] = multiprocessing.Pool(workers)
+    return pool
+
+
+def closePools():
+    """ End the worker processes started by Tree.walker(workers=n). They
+     are kept for the next walks until this is called, a later walk with
+     workers starts new ones."""
+    while _pools:
+        pool = _pools.popitem()[1]
+        pool.close()
+        pool.join()
+
+
+def _tobytes(a):
+    # Little endian bytes of an array
+    if sys.byteorder == "big":
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes() if hasattr(a, "tobytes") else a.tostring()
+
+
+def _frombytes(typecode, b):
+    # Array from little endian bytes
+    a = array(typecode)
+    if hasattr(a, "frombytes"):
+        a.frombytes(b)
+    else:
+        a.fromstring(b)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a
+
+
+class Tree(object):
 
     def __init__(self, data):
         # Start a tree with a root node
         self.root = Node(data)
         self.root.tree = self
         self.root.leftSibling = None
-        self.nodes = [self.root]
+        # Registry of all nodes, keyed by the node itself (nodes hash by
+        # identity) to make add, membership and removal O(1)
+        self._nodes = OrderedDict()
+        self._nodes[self.root] = None
+        # Incremental layout: distance of the last incremental walk, nodes
+        # whose children changed and nodes that were added since then
+        self._walked = None
+        self._dirty = set()
+        self._fresh = set()
+        # Nodes of every level sorted by x, built by the first query after
+        # a walk
+        self._index = None
+        # False if a children list was replaced, see normalize()
+        self._linked = True
+        # walkerAsync(): number of changes, running and finished layouts
+        self._version = 0
+        self._futures = {}
+        self._results = {}
+        self._lock = None
+        # Version and distances of the last complete walk, see _rescale()
+        self._previous = None
+        # Orientation of the positions and the x range mapped to the circle
+        # in the radial orientation
+        self._orientation = "top"
+        self._radial = (0.0, 1.0)
+        # Level heights of the last walk or None, see _levelOffsets()
+        self._heights = None
+
+    @property
+    def nodes(self):
+        # All nodes in insertion order as a new list, this takes O(n) on
+        # every access: keep the list instead of indexing T.nodes in a loop.
+        # len(T), node in T and "for node in T" do not copy the nodes.
+        return list(self._nodes)
+
+    def __iter__(self):
+        # The nodes in insertion order without a copy, the tree must not be
+        # changed while iterating
+        return iter(self._nodes)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def __contains__(self, node):
+        return node in self._nodes
+
+    @classmethod
+    def fromParentArray(cls, parents, data=None):
+        """ Build a tree from the parent index of every node.
+         The root has the parent -1 or None. Children are ordered by their
+         index. data is a sequence with the data of each node, by default
+         the data is the index.
+         Example:
+         T = Tree.fromParentArray([-1, 0, 0, 1], ["a", "b", "c", "d"])"""
+        if data is None:
+            data = myrange(len(parents))
+        nodes = [Node(d) for d in data]
+        if len(nodes) != len(parents):
+            raise ValueError("parents and data have different lengths")
+        root = None
+        for i, p in enumerate(parents):
+            if p is None or p < 0:
+                if root is not None:
+                    raise ValueError("More than one root")
+                root = nodes[i]
+            else:
+                nodes[p]._link(nodes[i])
+        return cls._fromRoot(root, nodes)
+
+    @classmethod
+    def fromEdges(cls, edges):
+        """ Build a tree from (parent, child) pairs.
+         The pairs contain the data of the nodes, which has to be hashable
+         and unique. Children are ordered like the edges.
+         Example:
+         T = Tree.fromEdges([("a", "b"), ("a", "c"), ("b", "d")])"""
+        nodes = OrderedDict()
+        children = set()
+        for p, c in edges:
+            if c in children:
+                raise ValueError("Node %r has more than one parent" % (c, ))
+            children.add(c)
+            if p not in nodes:
+                nodes[p] = Node(p)
+            if c not in nodes:
+                nodes[c] = Node(c)
+            nodes[p]._link(nodes[c])
+        root = None
+        for key, node in nodes.items():
+            if key not in children:
+                if root is not None:
+                    raise ValueError("More than one root")
+                root = node
+        if root is None:
+            raise ValueError("No root")
+        order = [root] + [node for node in nodes.values() if node is not root]
+        return cls._fromRoot(root, order)
+
+    @classmethod
+    def fromNested(cls, nested):
+        """ Build a tree from nested mappings or lists of pairs.
+         The keys are the data of the nodes and the values contain the
+         children the same way, or None for a leaf. The outer level
+         contains only the root. Children are ordered like the items, use
+         OrderedDict or (data, children) pairs where dicts are not ordered
+         (before Python 3.7).
+         Examples:
+         T = Tree.fromNested({"a": {"b": {"d": None}, "c": None}})
+         T = Tree.fromNested([("a", [("b", [("d", None)]), ("c", None)])])"""
+        if len(nested) != 1:
+            raise ValueError("Expected exactly one root")
+        order = []
+        stack = [(None, data, children) for data, children in
+                 (nested.items() if hasattr(nested, "items") else nested)]
+        while stack:
+            parent, data, children = stack.pop()
+            node = Node(data)
+            if parent is not None:
+                parent._link(node)
+            order.append(node)
+            if children:
+                if hasattr(children, "items"):
+                    children = children.items()
+                stack.extend([(node, d, c) for d, c in
+                              reversed(list(children))])
+        return cls._fromRoot(order[0], order)
+
+    @classmethod
+    def _fromRoot(cls, root, nodes):
+        # Make a tree from linked nodes in one pass, nodes is the order of
+        # the registry
+        if root is None:
+            raise ValueError("No root")
+        T = cls(root.data)
+        T.root = root
+        root.tree = T
+        root.leftSibling = None
+        T._nodes = OrderedDict()
+        count = 0
+        stack = [(root, 0)]
+        while stack:
+            v, depth = stack.pop()
+            v.tree = T
+            v.depth = depth
+            count += 1
+            if v._children:
+                stack.extend([(w, depth + 1) for w in v._children])
+        if count != len(nodes):
+            raise ValueError("Not all nodes are connected to the root")
+        for v in nodes:
+            T._nodes[v] = None
+        return T
+
+    def normalize(self):
+        """ Set parent, left sibling, number, tree and depth of all nodes in
+         O(n) and add new nodes to Tree.nodes. walker() calls this if a
+         children list was replaced, call it after changing a children list
+         in place. insertChild() and moveChild() keep them up to date."""
+        nodes = self._nodes
+        count = 1
+        stack = [self.root]
+        while stack:
+            v = stack.pop()
+            last = None
+            i = 0
+            depth = v.depth + 1
+            for w in v._children:
+                w.parent = v
+                w.leftSibling = last
+                w.layout.number = i
+                w.tree = self
+                w.depth = depth
+                if w not in nodes:
+                    nodes[w] = None
+                last = w
+                i += 1
+            count += i
+            stack.extend(v._children)
+        if count != len(nodes):
+            # Nodes that were removed from a children list in place
+            reached = set([self.root])
+            stack = [self.root]
+            while stack:
+                v = stack.pop()
+                reached.update(v._children)
+                stack.extend(v._children)
+            for v in [v for v in nodes if v not in reached]:
+                del nodes[v]
+                v.tree = None
+        self._linked = True
+        self._walked = None
+        self._version += 1
+        self._index = None
 
     def addNode(self, node):
         # add a child to the root
         return self.root.addNode(node)
 
-    def addChild(self, data):
+    def addChild(self, data, width=0, height=0):
         # add a child to the root
-        return self.root.addChild(data)
+        return self.root.addChild(data, width, height)
 
     def removeChild(self, node):
         # remove a child from the root
         return self.root.removeChild(node)
 
-    def walker(self, distance=1.0):
+    def insertChild(self, index, data, width=0, height=0):
+        # add a child to the root at position index
+        return self.root.insertChild(index, data, width, height)
+
+    def moveChild(self, node, index):
+        # move a child of the root to position index
+        return self.root.moveChild(node, index)
+
+    def walker(self, distance=1.0, recursive=False, incremental=False,
+               subtreeDistance=None, cache=None, workers=None, stats=False,
+               orientation="top"):
         # Init layout algorithm
-        self._firstWalk(self.root, distance)
-        self._secondWalk(self.root, -self.root.layout.prelim)
+        # distance is the gap between siblings and subtreeDistance the gap
+        # between neighbouring subtrees, by default the same as distance.
+        # Nodes with a width are separated by the gap plus their half
+        # widths. The levels are 1.0 apart, plus half the height of the
+        # highest node of both levels if a node has a height.
+        # The iterative walks are the default, they give the same
+        # coordinates as the recursive ones but are not limited by the
+        # recursion limit on deep trees.
+        # With incremental=True the tree records the changes made with
+        # addChild/addNode/removeChild and the next incremental walk only
+        # lays out the changed subtrees and their ancestors again.
+        # cache is a LayoutCache, identical subtrees are laid out only once
+        # and the cache can be reused for other walks and trees.
+        # With workers=n the subtrees below the first level with enough
+        # subtrees for the n processes are laid out in n processes and
+        # merged in this process. This is experimental: copying the
+        # subtrees to the processes and back costs about as much as their
+        # first walks, no speedup over the serial walk has been measured.
+        # The processes are kept for the next walks until closePools().
+        # With stats=True a LayoutStats is returned, otherwise None.
+        # If no node has a width, the layout is proportional to the
+        # distances: when only the distances changed since the last walk
+        # and keep their ratio, the last layout is scaled in O(n) instead.
+        # orientation is where the root is: "top", "bottom", "left", "right"
+        # or "radial" in the center with the levels on circles around it.
+        # layout.x() and layout.y() stay top down, the orientation is
+        # applied by positionf(), coordinates() and edges().
+        if orientation not in ("top", "bottom", "left", "right", "radial"):
+            raise ValueError("Unknown orientation %r" % (orientation, ))
+        if cache is not None and (recursive or incremental):
+            raise ValueError("cache is only used by the iterative layout")
+        if workers and (recursive or incremental or cache is not None):
+            raise ValueError("workers are only used by the iterative layout")
+        if incremental and recursive:
+            raise ValueError("incremental layout is not recursive")
+        if not stats:
+            self._walk(distance, recursive, incremental, subtreeDistance,
+                       cache, workers, None)
+            self._orient(orientation, distance, subtreeDistance)
+            return None
+        # Count the calls of _moveSubtree only while the stats are recorded
+        stats = LayoutStats()
+        self._moveSubtree = stats._counted(self._moveSubtree)
+        try:
+            t = default_timer()
+            self._walk(distance, recursive, incremental, subtreeDistance,
+                       cache, workers, stats.timings)
+            stats.timings["total"] = default_timer() - t
+        finally:
+            del self._moveSubtree
+        self._orient(orientation, distance, subtreeDistance)
+        stats._measure(self.root)
+        return stats
+
+    def _orient(self, orientation, distance, subtreeDistance):
+        # Set the orientation after a walk, the radial orientation maps the
+        # width of the tree and a gap to the full circle
+        self._orientation = orientation
+        if orientation == "radial":
+            left, right, levels = self._extent()
+            span = right - left + (distance if subtreeDistance is None
+                                   else subtreeDistance)
+            self._radial = (left, span if span > 0 else 1.0)
+
+    def _orientPoint(self, x, y):
+        # Position in the orientation from the top down position
+        return _oriented(x, y, self._orientation, self._radial)
+
+    def _unorientPoint(self, x, y):
+        # Top down position from the position in the orientation
+        orientation = self._orientation
+        if orientation == "top":
+            return x, y
+        elif orientation == "bottom":
+            return x, -y
+        elif orientation == "left":
+            return y, x
+        elif orientation == "right":
+            return y, -x
+        left, span = self._radial
+        a = math.atan2(y, x) % (2.0 * math.pi)
+        return left + span * a / (2.0 * math.pi), math.hypot(x, y)
+
+    def _orientArray(self, xy):
+        # _orientPoint() for the interleaved positions of an array("d") in
+        # place
+        return _orientedArray(xy, self._orientation, self._radial)
+
+    def _walk(self, distance, recursive, incremental, subtreeDistance, cache,
+              workers, timings):
+        # The layout of walker(), timings collects the time of the phases
+        self._index = None
+        if not self._linked:
+            self.normalize()
+        if incremental:
+            self._previous = None
+            if self._walked != (distance, subtreeDistance):
+                # First incremental walk, lay out everything
+                self._fresh = set([self.root])
+                self._dirty = set()
+            if timings is not None:
+                t = default_timer()
+            self._incrementalWalk(distance, subtreeDistance)
+            if timings is not None:
+                timings["incrementalWalk"] = default_timer() - t
+            self._walked = (distance, subtreeDistance)
+            self._dirty = set()
+            self._fresh = set()
+            return
+        self._walked = None
+        if subtreeDistance is None:
+            subtreeDistance = distance
+        if timings is not None:
+            t = default_timer()
+        if self._rescale(distance, subtreeDistance):
+            if timings is not None:
+                timings["rescale"] = default_timer() - t
+            return
+        if recursive:
+            self._firstWalk(self.root, distance, subtreeDistance)
+        elif cache is not None:
+            self._firstWalkCached(self.root, distance, subtreeDistance, cache)
+        elif workers:
+            self._firstWalkParallel(self.root, distance, subtreeDistance,
+                                    workers)
+        else:
+            self._firstWalkIterative(self.root, distance, subtreeDistance)
+        if timings is not None:
+            timings["firstWalk"] = default_timer() - t
+            t = default_timer()
+        if recursive:
+            tall = self._secondWalk(self.root, -self.root.layout.prelim, 0)
+        else:
+            tall = self._secondWalkIterative(self.root,
+                                             -self.root.layout.prelim)
+        self._heights = self._spreadLevels(self.root) if tall else None
+        if timings is not None:
+            timings["secondWalk"] = default_timer() - t
+        self._previous = (self._version, distance, subtreeDistance)
+
+    def _rescale(self, distance, subtreeDistance):
+        # Scale the last layout to new distances, returns False if the tree
+        # changed or the layout is not proportional to the distances
+        previous = self._previous
+        if previous is None or previous[0] != self._version:
+            return False
+        version, d, s = previous
+        if d <= 0 or distance <= 0 or s * distance != subtreeDistance * d:
+            return False
+        if distance == d:
+            return True
+        nodes = []
+        stack = [self.root]
+        while stack:
+            v = stack.pop()
+            if v.width:
+                return False
+            nodes.append(v)
+            stack.extend(v.visible)
+        k = distance / float(d)
+        for v in nodes:
+            layout = v.layout
+            layout.prelim *= k
+            layout.mod *= k
+            layout.pos[0] *= k
+        self._previous = (version, distance, subtreeDistance)
+        return True
+
+    def walkerAsync(self, distance=1.0, subtreeDistance=None, executor=None,
+                    loop=None, orientation=None):
+        """ Calculate the layout in an executor of the asyncio event loop,
+         by default a thread pool. Returns an awaitable future of a copy of
+         coordinates(). Concurrent requests with the same distances share
+         one layout, and the coordinates are returned from a cache until
+         the tree is changed with addChild/addNode/removeChild or the other
+         methods that change the tree. The layouts run one at a time, do
+         not change the tree while one runs. orientation is the same as in
+         walker(), by default the orientation of the last walk. Without
+         loop it has to be called in a coroutine of the running loop.
+         Example:
+         xy = await T.walkerAsync(1.0)"""
+        if asyncio is None:
+            raise RuntimeError("walkerAsync() requires asyncio")
+        if loop is None:
+            if hasattr(asyncio, "get_running_loop"):
+                loop = asyncio.get_running_loop()
+            else:  # Python < 3.7
+                loop = asyncio.get_event_loop()
+        if self._lock is None:
+            self._lock = threading.Lock()
+        if orientation is None:
+            orientation = self._orientation
+        key = (distance, subtreeDistance, orientation)
+        result = self._results.get(key)
+        if result is not None and result[0] == self._version:
+            future = _future(loop)
+            future.set_result(result[1][:])
+            return future
+        request = (self._version, ) + key
+        future = self._futures.get(request)
+        if future is None:
+            future = loop.run_in_executor(executor, self._walkLocked,
+                                          distance, subtreeDistance,
+                                          orientation)
+            self._futures[request] = future
+
+            def done(future):
+                del self._futures[request]
+                if future.cancelled() or future.exception() is not None:
+                    return
+                version, xy = future.result()
+                if version == self._version:
+                    self._results = dict(
+                        (k, v) for k, v in self._results.items()
+                        if v[0] == version)
+                    self._results[key] = (version, xy)
+
+            future.add_done_callback(done)
+        # Each caller gets its own future, cancelling it does not cancel the
+        # shared layout
+        caller = _future(loop)
+
+        def resolve(future):
+            if caller.cancelled():
+                return
+            if future.cancelled():
+                caller.cancel()
+            elif future.exception() is not None:
+                caller.set_exception(future.exception())
+            else:
+                caller.set_result(future.result()[1][:])
+
+        future.add_done_callback(resolve)
+        return caller
+
+    def _walkLocked(self, distance, subtreeDistance, orientation):
+        # Layout of walkerAsync() in the executor
+        with self._lock:
+            version = self._version
+            self.walker(distance, subtreeDistance=subtreeDistance,
+                        orientation=orientation)
+            return version, self.coordinates()
+
+    def coordinates(self, origin=(0.0, 0.0), scalex=1.0, scaley=None):
+        """ Return the positions of all nodes in the order of Tree.nodes as
+         a flat array("d") x0, y0, x1, y1, ... with the same values as
+         positionf(). Children of collapsed nodes and nodes that were not
+         laid out yet are NaN. Origin and scale are applied to the whole
+         array at once, with numpy if it is installed. The array supports
+         the buffer protocol,
+         e.g. numpy.frombuffer(T.coordinates()).reshape(-1, 2)
+         Examples:
+         coordinates(origin)
+         coordinates(origin, 10)
+         coordinates(origin, 10, 15)
+         coordinates(origin, (10, 15))"""
+        return _transform(self._orientArray(self._positions()), origin,
+                          scalex, scaley)
+
+    def _positions(self):
+        # Top down positions of all nodes as x0, y0, x1, y1, ..., NaN for
+        # hidden nodes and nodes without a position
+        nodes = self._nodes
+        nan = float("nan")
+        xy = array("d", [0.0]) * (2 * len(nodes))
+        try:
+            xy[0::2] = array("d", [node.layout.pos[0] for node in nodes])
+            xy[1::2] = array("d", [node.layout.pos[1] for node in nodes])
+        except TypeError:
+            xy[0::2] = array("d", [nan if node.layout.pos[0] is None
+                                   else node.layout.pos[0] for node in nodes])
+            xy[1::2] = array("d", [nan if node.layout.pos[1] is None
+                                   else node.layout.pos[1] for node in nodes])
+        hidden = self._hidden()
+        if hidden:
+            for i, node in enumerate(nodes):
+                if node in hidden:
+                    xy[2 * i] = xy[2 * i + 1] = nan
+        return xy
+
+    def _hidden(self):
+        # The descendants of collapsed nodes
+        hidden = set()
+        stack = [w for v in self._nodes if v.visible is not v._children
+                 for w in v._children]
+        while stack:
+            v = stack.pop()
+            if v not in hidden:
+                hidden.add(v)
+                stack.extend(v._children)
+        return hidden
+
+    def parentIndices(self):
+        # Index of the parent of every node in the order of Tree.nodes,
+        # -1 for the root. Together with coordinates() this gives the edges.
+        index = dict((node, i) for i, node in enumerate(self._nodes))
+        return array("i", [index.get(node.parent, -1) for node in self._nodes])
+
+    def edges(self, style="straight", origin=(0.0, 0.0), scalex=1.0,
+              scaley=None):
+        """ Return the geometry of all edges as one flat array("d"), one
+         edge from the parent to the child for every node but the root in
+         the order of Tree.nodes. Every edge has the same number of points
+         x, y:
+         "straight": parent and child, 4 values per edge
+         "elbow": parent, the two bends halfway between the levels and the
+                  child, 8 values per edge
+         "spline": the control points of a cubic Bezier curve from the
+                   parent to the child, 8 values per edge
+         The bends are halfway between the levels in every orientation.
+         Orientation, origin and scale are applied like in coordinates(),
+         with numpy if it is installed. The edges of hidden nodes are NaN,
+         e.g.
+         numpy.frombuffer(T.edges("elbow")).reshape(-1, 4, 2)
+         Examples:
+         edges()
+         edges("elbow", origin, 10, 15)"""
+        if style not in ("straight", "elbow", "spline"):
+            raise ValueError("Unknown edge style %r" % (style, ))
+        xy = self._positions()
+        parents = self.parentIndices()
+        points = 2 if style == "straight" else 4
+        count = len(parents) - parents.count(-1)
+        result = array("d", [0.0]) * (2 * points * count)
+        if numpy is not None:
+            a = numpy.frombuffer(xy, dtype=numpy.float64).reshape(-1, 2)
+            p = numpy.frombuffer(parents, dtype=numpy.intc)
+            children = numpy.nonzero(p >= 0)[0]
+            start = a[p[children]]
+            end = a[children]
+            r = numpy.frombuffer(result, dtype=numpy.float64).reshape(
+                -1, points, 2)
+            r[:, 0] = start
+            r[:, -1] = end
+            if points == 4:
+                middle = 0.5 * (start[:, 1] + end[:, 1])
+                r[:, 1, 0] = start[:, 0]
+                r[:, 1, 1] = middle
+                r[:, 2, 0] = end[:, 0]
+                r[:, 2, 1] = middle
+        else:
+            k = 0
+            for i, p in enumerate(parents):
+                if p < 0:
+                    continue
+                x0, y0 = xy[2 * p], xy[2 * p + 1]
+                x1, y1 = xy[2 * i], xy[2 * i + 1]
+                if points == 2:
+                    result[k:k + 4] = array("d", (x0, y0, x1, y1))
+                else:
+                    middle = 0.5 * (y0 + y1)
+                    result[k:k + 8] = array(
+                        "d", (x0, y0, x0, middle, x1, middle, x1, y1))
+                k += 2 * points
+        return _transform(self._orientArray(result), origin, scalex, scaley)
+
+    def iterLayout(self, distance=1.0, subtreeDistance=None):
+        """ Calculate the layout and yield (node, x, y) in pre-order while
+         the second walk runs. The positions are stored in the nodes as
+         with walker().
+         Example:
+         for node, x, y in T.iterLayout(1.0):
+             print(node.data, x, y)"""
+        for node, x, y, i, parent in self._iterLayout(distance,
+                                                      subtreeDistance):
+            yield node, x, y
+
+    def writeJSONLines(self, f, distance=1.0, subtreeDistance=None,
+                       origin=(0.0, 0.0), scalex=1.0, scaley=None):
+        """ Calculate the layout and write one JSON object per node to the
+         file object f while the second walk runs:
+         {"id": 0, "parent": -1, "data": "a1", "x": 0.0, "y": 0.0}
+         Nodes are numbered in pre-order. Data that JSON does not support is
+         written as a string."""
+        scalex, scaley = _scales(scalex, scaley)
+        ox, oy = origin
+        for node, x, y, i, parent in self._iterLayout(distance,
+                                                      subtreeDistance):
+            f.write(json.dumps({"id": i, "parent": parent, "data": node.data,
+                                "x": ox + (x * scalex),
+                                "y": oy + (y * scaley)},
+                               default=str, sort_keys=True))
+            f.write("\n")
+
+    def writeDOT(self, f, distance=1.0, subtreeDistance=None, scalex=72.0,
+                 scaley=None, label=str):
+        """ Calculate the layout and write a Graphviz graph with fixed
+         positions to the file object f while the second walk runs. Render
+         it with "neato -n2". label is a function that returns the label of
+         a node from its data."""
+        scalex, scaley = _scales(scalex, scaley)
+        f.write("digraph {\n")
+        for node, x, y, i, parent in self._iterLayout(distance,
+                                                      subtreeDistance):
+            text = label(node.data).replace("\\", "\\\\")
+            f.write('  n%d [label="%s", pos="%r,%r!"];\n' % (
+                i, text.replace('"', '\\"'), x * scalex, -y * scaley))
+            if parent != -1:
+                f.write("  n%d -> n%d;\n" % (parent, i))
+        f.write("}\n")
+
+    def writeSVG(self, f, distance=1.0, subtreeDistance=None, scalex=50.0,
+                 scaley=None, radius=15.0, label=str):
+        """ Calculate the layout and write an SVG image to the file object f
+         while the second walk runs. Nodes are drawn as circles with the
+         label inside, nodes with a width as rounded rectangles. label is a
+         function that returns the label of a node from its data."""
+        scalex, scaley = _scales(scalex, scaley)
+        nodes = self._iterLayout(distance, subtreeDistance)
+        # The first walk is done when the first node is yielded, the size
+        # of the image is known from the contours
+        node, x, y, i, parent = next(nodes)
+        left, right, levels = self._extent()
+        bottom = self._levelOffsets(self.root)[1][levels - 1]
+        margin = 2 * radius
+        f.write('<svg xmlns="http://www.w3.org/2000/svg" '
+                'viewBox="%r %r %r %r" width="%d" height="%d">\n' % (
+                    left * scalex - margin, -margin,
+                    (right - left) * scalex + 2 * margin,
+                    bottom * scaley + 2 * margin,
+                    math.ceil((right - left) * scalex + 2 * margin),
+                    math.ceil(bottom * scaley + 2 * margin)))
+        f.write('<g stroke="black" fill="white" font-size="%r" '
+                'text-anchor="middle">\n' % radius)
+        while True:
+            cx = x * scalex
+            cy = y * scaley
+            if node.parent is not None:
+                # Edge from the border of the parent
+                px = node.parent.layout.pos[0] * scalex
+                py = node.parent.layout.pos[1] * scaley
+                dx = cx - px
+                dy = cy - py
+                d = math.sqrt(dx * dx + dy * dy)
+                f.write('<line x1="%r" y1="%r" x2="%r" y2="%r"/>\n' % (
+                    px + dx * radius / d, py + dy * radius / d,
+                    cx - dx * radius / d, cy - dy * radius / d))
+            if node.width:
+                w = node.width * scalex
+                f.write('<rect x="%r" y="%r" width="%r" height="%r" '
+                        'rx="%r"/>\n' % (cx - 0.5 * w, cy - radius, w,
+                                         2 * radius, radius))
+            else:
+                f.write('<circle cx="%r" cy="%r" r="%r"/>\n' % (
+                    cx, cy, radius))
+            f.write('<text x="%r" y="%r" stroke="none" fill="black" '
+                    'dominant-baseline="central">%s</text>\n' % (
+                        cx, cy, escape(label(node.data))))
+            try:
+                node, x, y, i, parent = next(nodes)
+            except StopIteration:
+                break
+        f.write('</g>\n</svg>\n')
+
+    def writeSnapshot(self, f):
+        """ Write the structure and the current layout to the binary file
+         object f. The file contains the orientation, x, y, width, height,
+         the parent index and the index among its siblings of every node in
+         the order of Tree.nodes as fixed-width columns and the data of the
+         nodes as JSON in a string table. x and y are top down, the
+         orientation is applied when the positions are read. Load it with
+         LayoutSnapshot, which maps the file into memory.
+         Example:
+         T.walker(1.0)
+         with open("tree.layout", "wb") as f:
+             T.writeSnapshot(f)"""
+        nodes = self._nodes
+        xy = self._positions()
+        numbers = {}
+        for v in nodes:
+            for i, w in enumerate(v._children):
+                numbers[w] = i
+        encode = json.JSONEncoder(default=str).encode
+        strings = [encode(v.data).encode("utf-8") for v in nodes]
+        offsets = [0]
+        for b in strings:
+            offsets.append(offsets[-1] + len(b))
+        left, span = self._radial
+        f.write(LayoutSnapshot._header.pack(LayoutSnapshot._magic,
+                                            LayoutSnapshot._version,
+                                            len(nodes),
+                                            self._orientation.encode("ascii"),
+                                            left, span))
+        for column in (xy[0::2], xy[1::2],
+                       array("d", [v.width for v in nodes]),
+                       array("d", [v.height for v in nodes])):
+            f.write(_tobytes(column))
+        f.write(struct.pack("<%dq" % len(offsets), *offsets))
+        f.write(_tobytes(self.parentIndices()))
+        f.write(_tobytes(array("i", [numbers.get(v, 0) for v in nodes])))
+        f.write(b"".join(strings))
+
+    def _iterLayout(self, distance, subtreeDistance):
+        # walker() as a generator, the second walk yields
+        # (node, x, y, index, parent index) in pre-order
+        self._walked = None
+        self._index = None
+        self._previous = None
+        self._orientation = "top"
+        if not self._linked:
+            self.normalize()
+        if subtreeDistance is None:
+            subtreeDistance = distance
+        self._firstWalkIterative(self.root, distance, subtreeDistance)
+        heights, ys = self._levelOffsets(self.root)
+        stack = [(self.root, -self.root.layout.prelim, 0, -1)]
+        i = 0
+        while stack:
+            v, m, level, parent = stack.pop()
+            x = v.layout.prelim + m
+            y = ys[level]
+            v.layout.pos[0] = x
+            v.layout.pos[1] = y
+            yield v, x, y, i, parent
+            if v.visible:
+                m = m + v.layout.mod
+                stack.extend([(w, m, level + 1, i)
+                              for w in reversed(v.visible)])
+            i += 1
+
+    def nodesInRect(self, x0, y0, x1, y1, origin=(0.0, 0.0), scalex=1.0,
+                    scaley=None):
+        """ Return the nodes whose position after walker() is inside the
+         rectangle from (x0, y0) to (x1, y1), level by level from left to
+         right. Children of collapsed nodes are not included. With origin
+         and scale the rectangle is given in the coordinates of
+         positionf(). The sorted x positions of each level are indexed once
+         after every walk, then a query takes O(log n) per level plus the
+         number of nodes found.
+         Examples:
+         nodesInRect(-2.0, 0, 2.0, 3)
+         nodesInRect(0, 0, 800, 600, (400, 20), 50, 80)"""
+        x0, y0 = self._toLayout(x0, y0, origin, scalex, scaley)
+        x1, y1 = self._toLayout(x1, y1, origin, scalex, scaley)
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+        ys, levels = self._levelIndex()
+        result = []
+        if self._orientation == "radial":
+            # The levels on the circles that cross the rectangle
+            nearx = min(max(0.0, x0), x1)
+            neary = min(max(0.0, y0), y1)
+            far = max([math.hypot(x, y) for x in (x0, x1) for y in (y0, y1)])
+            for level in myrange(bisect_left(ys, math.hypot(nearx, neary)),
+                                 bisect_right(ys, far)):
+                xs, nodes = levels[level]
+                for x, node in zip(xs, nodes):
+                    px, py = self._orientPoint(x, ys[level])
+                    if x0 <= px <= x1 and y0 <= py <= y1:
+                        result.append(node)
+            return result
+        x0, y0 = self._unorientPoint(x0, y0)
+        x1, y1 = self._unorientPoint(x1, y1)
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+        for level in myrange(bisect_left(ys, y0), bisect_right(ys, y1)):
+            xs, nodes = levels[level]
+            result.extend(nodes[bisect_left(xs, x0):bisect_right(xs, x1)])
+        return result
+
+    def nodeAt(self, x, y, origin=(0.0, 0.0), scalex=1.0, scaley=None,
+               radius=0.5):
+        """ Return the node at the point (x, y) in the coordinates of
+         positionf() with the same origin and scale, or None. A node covers
+         radius around its position, or half its scaled width and height
+         if they are larger. Uses the same index as nodesInRect() and
+         takes O(log n).
+         Examples:
+         nodeAt(0.2, 1.1)
+         nodeAt(mousex, mousey, (400, 20), 50, 80, 15)"""
+        scalex, scaley = _scales(scalex, scaley)
+        qx, qy = self._toLayout(x, y, origin, scalex, scaley)
+        lx, ly = self._unorientPoint(qx, qy)
+        ys, levels = self._levelIndex()
+        best = None
+        i = bisect_left(ys, ly)
+        for level in (i - 1, i):
+            if level < 0 or level >= len(ys):
+                continue
+            xs, nodes = levels[level]
+            j = bisect_left(xs, lx)
+            candidates = (j - 1, j)
+            if self._orientation == "radial":
+                # The angle wraps around between the first and the last node
+                candidates = (j - 1, j, 0, len(xs) - 1)
+            for k in candidates:
+                if k < 0 or k >= len(xs):
+                    continue
+                v = nodes[k]
+                px, py = self._orientPoint(xs[k], ys[level])
+                dx = abs(qx - px) * abs(scalex)
+                dy = abs(qy - py) * abs(scaley)
+                if self._orientation in ("top", "bottom"):
+                    w, h = v.width, v.height
+                elif self._orientation in ("left", "right"):
+                    w, h = v.height, v.width
+                else:
+                    w = h = 0.0
+                if dx <= max(radius, 0.5 * w * abs(scalex)) and \
+                        dy <= max(radius, 0.5 * h * abs(scaley)):
+                    if best is None or dx * dx + dy * dy < best[0]:
+                        best = (dx * dx + dy * dy, v)
+        return best[1] if best is not None else None
+
+    @staticmethod
+    def _toLayout(x, y, origin, scalex, scaley):
+        # Inverse of origin and scale of positionf()
+        scalex, scaley = _scales(scalex, scaley)
+        return (x - origin[0]) / float(scalex), (y - origin[1]) / float(scaley)
+
+    def _levelIndex(self):
+        # y of every level and the x positions and nodes of every level, in
+        # pre-order the nodes of a level are already sorted from left to
+        # right. Nodes that were added after the last walk have no position
+        # and are left out.
+        if self._index is None:
+            ys = []
+            levels = []
+            stack = [(self.root, 0)]
+            while stack:
+                v, level = stack.pop()
+                if level == len(levels):
+                    ys.append(None)
+                    levels.append((array("d"), []))
+                if v.layout.pos[0] is not None:
+                    if ys[level] is None:
+                        ys[level] = v.layout.pos[1]
+                    xs, nodes = levels[level]
+                    xs.append(v.layout.pos[0])
+                    nodes.append(v)
+                level += 1
+                stack.extend([(w, level) for w in reversed(v.visible)])
+            keep = [i for i in myrange(len(ys)) if ys[i] is not None]
+            self._index = (array("d", [ys[i] for i in keep]),
+                           [levels[i] for i in keep])
+        return self._index
+
+    def _extent(self):
+        # Leftmost and rightmost border and the number of levels, from the
+        # contours after the first walk in O(depth)
+        lefts, rights = self._contours()
+        return min(lefts), max(rights), len(lefts)
+
+    def _contours(self):
+        # Left and right border of every level relative to the root, from
+        # the contours after the first walk in O(depth)
+        root = self.root
+        lefts = []
+        v = root
+        m = -root.layout.prelim
+        while v is not None:
+            lefts.append(v.layout.prelim + m - 0.5 * v.width)
+            m = m + v.layout.mod
+            v = v.nextLeft()
+        rights = []
+        v = root
+        m = -root.layout.prelim
+        while v is not None:
+            rights.append(v.layout.prelim + m + 0.5 * v.width)
+            m = m + v.layout.mod
+            v = v.nextRight()
+        return lefts, rights
 
     def _add(self, node):
-        if node not in self.nodes:
-            self.nodes.append(node)
+        if node not in self._nodes:
+            self._nodes[node] = None
         return node
 
-    def _firstWalk(self, v, distance):
-        if v.children:
-            defaultAncestor = v.children[0]
-            for w in v.children:
-                self._firstWalk(w, distance)
-                self._apportion(w, defaultAncestor, distance)
+    def _remove(self, node):
+        self._nodes.pop(node, None)
+        return node
+
+    def _changed(self, parent, node=None):
+        # Record a change for the next incremental walk
+        self._version += 1
+        self._index = None
+        if self._walked is not None:
+            self._dirty.add(parent)
+            if node is not None:
+                self._fresh.add(node)
+
+    def _firstWalk(self, v, distance, subtreeDistance):
+        v.layout.reset()
+        if v.visible:
+            defaultAncestor = v.visible[0]
+            for w in v.visible:
+                self._firstWalk(w, distance, subtreeDistance)
+                defaultAncestor = self._apportion(w, defaultAncestor,
+                                                  subtreeDistance)
             self._executeShifts(v)
             midpoint = 0.5 * \
-                (v.children[0].layout.prelim + v.children[-1].layout.prelim)
+                (v.visible[0].layout.prelim + v.visible[-1].layout.prelim)
             w = self._leftSibling(v)
             if w is not None:
-                v.layout.prelim = w.layout.prelim + distance
+                v.layout.prelim = w.layout.prelim + \
+                    (distance + 0.5 * (w.width + v.width))
                 v.layout.mod = v.layout.prelim - midpoint
             else:
                 v.layout.prelim = midpoint
         else:
             ls = self._leftSibling(v)
             if ls:
-                v.layout.prelim = ls.layout.prelim + distance
+                v.layout.prelim = ls.layout.prelim + \
+                    (distance + 0.5 * (ls.width + v.width))
 
-    def _secondWalk(self, v, m):
+    def _secondWalk(self, v, m, level):
+        # Returns True if a node has a height
         v.layout.x(v.layout.prelim + m)
-        for w in v.children:
-            self._secondWalk(w, m + v.layout.mod)
+        v.layout.y(level)
+        tall = bool(v.height)
+        for w in v.visible:
+            tall = self._secondWalk(w, m + v.layout.mod, level + 1) or tall
+        return tall
 
-    def _apportion(self, v, defaultAncestor, distance):
+    def _levelOffsets(self, root):
+        # Maximum node height of every level below root and the y of every
+        # level: one apart plus half the heights of both levels. Without
+        # heights y is the level and the heights are None.
+        heights = []
+        level = [root]
+        while level:
+            heights.append(max([v.height for v in level]))
+            level = [w for v in level for w in v.visible]
+        if not any(heights):
+            return None, myrange(len(heights))
+        ys = [0.0]
+        for i in myrange(1, len(heights)):
+            ys.append(ys[-1] + 1.0 + 0.5 * (heights[i - 1] + heights[i]))
+        return heights, ys
+
+    def _spreadLevels(self, root):
+        # Set y of the nodes below root from _levelOffsets() after a second
+        # walk, returns the heights
+        heights, ys = self._levelOffsets(root)
+        stack = [(root, 0)]
+        while stack:
+            v, level = stack.pop()
+            v.layout.pos[1] = ys[level]
+            if v.visible:
+                stack.extend([(w, level + 1) for w in v.visible])
+        return heights
+
+    def _firstWalkIterative(self, v, distance, subtreeDistance, log=False):
+        # Post-order traversal with an explicit stack, performs the same
+        # operations in the same order as _firstWalk
+        # log=True records the changes to the contours for the incremental
+        # layout
+        # The layout of every node is reset when the node is entered, before
+        # any apportion can change it, so nothing is left from the last walk
+        v.layout.reset()
+        nodes = [v]
+        indices = [0]
+        ancestors = [v.visible[0] if v.visible else None]
+        while nodes:
+            v = nodes[-1]
+            i = indices[-1]
+            if i < len(v.visible):
+                indices[-1] = i + 1
+                w = v.visible[i]
+                w.layout.reset()
+                nodes.append(w)
+                indices.append(0)
+                ancestors.append(w.visible[0] if w.visible else None)
+                continue
+            nodes.pop()
+            indices.pop()
+            ancestors.pop()
+            if v.visible:
+                self._executeShifts(v)
+            self._placeNode(v, distance)
+            if nodes:
+                w = nodes[-1]
+                ancestors[-1] = self._apportion(
+                    v, ancestors[-1], subtreeDistance,
+                    w.layout.log if log else None)
+
+    def _firstWalkCached(self, v, distance, subtreeDistance, cache):
+        # _firstWalkIterative that copies the layout of subtrees from the
+        # cache and stores the layout of subtrees that occur repeatedly
+        key = (distance, subtreeDistance)
+        shapes, counts = cache._shapes(v)
+        capture = set()
+
+        def lookup(w, parent):
+            # Copy the layout of the subtree of w from the cache
+            shape = shapes[w]
+            if cache._copy(w, (shape, key)):
+                return True
+            # Store it after the walk if the shape is repeated more often
+            # than the shape of the parent, otherwise the parent is stored
+            if counts[shape] > (counts[shapes[parent]] if parent else 0):
+                capture.add(w)
+            return False
+
+        if v.visible and lookup(v, None):
+            self._placeNode(v, distance)
+            return
+        v.layout.reset()
+        nodes = [v]
+        indices = [0]
+        ancestors = [v.visible[0] if v.visible else None]
+        while nodes:
+            v = nodes[-1]
+            i = indices[-1]
+            if i < len(v.visible):
+                indices[-1] = i + 1
+                w = v.visible[i]
+                if w.visible and lookup(w, v):
+                    self._placeNode(w, distance)
+                    ancestors[-1] = self._apportion(w, ancestors[-1],
+                                                    subtreeDistance)
+                    continue
+                w.layout.reset()
+                nodes.append(w)
+                indices.append(0)
+                ancestors.append(w.visible[0] if w.visible else None)
+                continue
+            nodes.pop()
+            indices.pop()
+            ancestors.pop()
+            if v.visible:
+                self._executeShifts(v)
+                if v in capture:
+                    cache._store(v, (shapes[v], key))
+            self._placeNode(v, distance)
+            if nodes:
+                ancestors[-1] = self._apportion(v, ancestors[-1],
+                                                subtreeDistance)
+
+    def _firstWalkParallel(self, v, distance, subtreeDistance, workers):
+        # Subtrees are independent until they are placed next to their
+        # siblings. The tree is split at the first level with about four
+        # subtrees per worker, or where the part above it gets too large.
+        # The first walks of the subtrees run in a process pool on a
+        # CompactTree copy, the relative layouts are copied back and the
+        # part above the split is walked here with the same apportion as
+        # usual.
+        target = 4 * workers
+        limit = len(self._nodes) // target
+        level = list(v.visible)
+        top = 1 + len(level)
+        while level and top < limit and \
+                len([w for w in level if w.visible]) < target:
+            level = [c for w in level for c in w.visible]
+            top += len(level)
+        split = [w for w in level if w.visible]
+        subtrees = [self._serialize(w) for w in split]
+        jobs = sorted(myrange(len(subtrees)),
+                      key=lambda i: -len(subtrees[i][0]))  # largest first
+        results = []
+        if jobs:
+            results = _pool(workers).map(_walkSubtree, [
+                (subtrees[i][1], subtrees[i][2], distance, subtreeDistance)
+                for i in jobs], 1)
+        for i, result in zip(jobs, results):
+            _restore(subtrees[i][0], *result)
+
+        # First walk above the split like _firstWalkCached()
+        done = set(split)
+        v.layout.reset()
+        nodes = [v]
+        indices = [0]
+        ancestors = [v.visible[0] if v.visible else None]
+        while nodes:
+            v = nodes[-1]
+            i = indices[-1]
+            if i < len(v.visible):
+                indices[-1] = i + 1
+                w = v.visible[i]
+                if w in done:
+                    self._placeNode(w, distance)
+                    ancestors[-1] = self._apportion(w, ancestors[-1],
+                                                    subtreeDistance)
+                    continue
+                w.layout.reset()
+                nodes.append(w)
+                indices.append(0)
+                ancestors.append(w.visible[0] if w.visible else None)
+                continue
+            nodes.pop()
+            indices.pop()
+            ancestors.pop()
+            if v.visible:
+                self._executeShifts(v)
+            self._placeNode(v, distance)
+            if nodes:
+                ancestors[-1] = self._apportion(v, ancestors[-1],
+                                                subtreeDistance)
+
+    @staticmethod
+    def _serialize(v):
+        # The subtree of v in level order as nodes, parent indices and
+        # widths, one list comprehension per level
+        nodes = [v]
+        parents = array("i", [-1])
+        level = [v]
+        start = 0
+        while level:
+            parents.extend([i for i, w in enumerate(level, start)
+                            for c in w.visible])
+            start += len(level)
+            level = [c for w in level for c in w.visible]
+            nodes.extend(level)
+        return nodes, parents, array("d", [w.width for w in nodes])
+
+    def _placeNode(self, v, distance):
+        # Set prelim and mod of v, after its children were placed
+        if v.visible:
+            midpoint = 0.5 * \
+                (v.visible[0].layout.prelim + v.visible[-1].layout.prelim)
+            w = self._leftSibling(v)
+            if w is not None:
+                v.layout.prelim = w.layout.prelim + \
+                    (distance + 0.5 * (w.width + v.width))
+                v.layout.mod = v.layout.prelim - midpoint
+            else:
+                v.layout.prelim = midpoint
+        else:
+            ls = self._leftSibling(v)
+            if ls:
+                v.layout.prelim = ls.layout.prelim + \
+                    (distance + 0.5 * (ls.width + v.width))
+
+    def _incrementalWalk(self, distance, subtreeDistance):
+        # Nodes that have to be walked again: changed nodes and ancestors
+        rerun = set()
+        for v in self._dirty | self._fresh:
+            while v is not None and v.tree is self and v not in rerun:
+                rerun.add(v)
+                v = v.parent
+        if not rerun:
+            return
+
+        # Undo the changes that these nodes made to the contours of their
+        # subtrees in the last walk, parents before children because the
+        # parents made their changes later
+        stack = [self.root]
+        while stack:
+            v = stack.pop()
+            if v in self._fresh:
+                continue
+            log = v.layout.log
+            if log:
+                for layout, name, value in reversed(log):
+                    setattr(layout, name, value)
+            v.layout.log = [] if v.visible else None
+            v.layout.reset()
+            stack.extend([w for w in v.visible if w in rerun])
+
+        # First walk: fresh subtrees are walked completely, unchanged
+        # subtrees keep their layout and only the subtree root is placed
+        # again next to its new left sibling
+        if subtreeDistance is None:
+            subtreeDistance = distance
+        if self.root in self._fresh:
+            self._resetSubtree(self.root, True)
+            self._firstWalkIterative(self.root, distance, subtreeDistance,
+                                     True)
+        else:
+            nodes = [self.root]
+            indices = [0]
+            ancestors = [self.root.visible[0] if self.root.visible
+                         else None]
+            while nodes:
+                v = nodes[-1]
+                i = indices[-1]
+                if i < len(v.visible):
+                    indices[-1] = i + 1
+                    w = v.visible[i]
+                    if w in self._fresh:
+                        self._resetSubtree(w, True)
+                        self._firstWalkIterative(w, distance,
+                                                 subtreeDistance, True)
+                    elif w in rerun:
+                        nodes.append(w)
+                        indices.append(0)
+                        ancestors.append(w.visible[0] if w.visible
+                                         else None)
+                        continue
+                    else:
+                        w.layout.reset()
+                        self._placeNode(w, distance)
+                    ancestors[-1] = self._apportion(
+                        w, ancestors[-1], subtreeDistance, v.layout.log)
+                    continue
+                nodes.pop()
+                indices.pop()
+                ancestors.pop()
+                if v.visible:
+                    self._executeShifts(v)
+                self._placeNode(v, distance)
+                if nodes:
+                    w = nodes[-1]
+                    ancestors[-1] = self._apportion(
+                        v, ancestors[-1], subtreeDistance, w.layout.log)
+
+        # Second walk: skip unchanged subtrees that did not move. If a node
+        # has a height, the levels are moved apart afterwards.
+        tall = self._heights is not None or \
+            any([w.height for v in self._dirty for w in v.visible])
+        stack = [(self.root, -self.root.layout.prelim, 0, False)]
+        while stack:
+            v, m, level, changed = stack.pop()
+            layout = v.layout
+            x = layout.prelim + m
+            if v in self._fresh:
+                changed = True
+            elif not changed and v not in rerun:
+                if x == layout.pos[0] and m + layout.mod == layout.offset:
+                    continue
+            layout.pos[0] = x
+            layout.pos[1] = level
+            if v.height:
+                tall = True
+            if v.visible:
+                m = m + layout.mod
+                layout.offset = m
+                level += 1
+                stack.extend([(w, m, level, changed) for w in v.visible])
+        if tall:
+            self._heights = self._spreadLevels(self.root)
+
+    def _resetSubtree(self, v, log=False):
+        # Reset the layout of all nodes in the subtree of v, log=True
+        # prepares the nodes for the incremental layout
+        stack = [v]
+        while stack:
+            v = stack.pop()
+            v.layout.reset()
+            v.layout.log = [] if log and v.visible else None
+            stack.extend(v.visible)
+
+    def _secondWalkIterative(self, v, m):
+        # Pre-order traversal with an explicit stack, returns True if a node
+        # has a height
+        tall = False
+        stack = [(v, m, 0)]
+        while stack:
+            v, m, level = stack.pop()
+            v.layout.pos[0] = v.layout.prelim + m
+            v.layout.pos[1] = level
+            if v.height:
+                tall = True
+            if v.visible:
+                m = m + v.layout.mod
+                level += 1
+                stack.extend([(w, m, level) for w in v.visible])
+        return tall
+
+    def _apportion(self, v, defaultAncestor, distance, log=None):
+        # log records the changes made to the contours of the subtrees for
+        # the incremental layout
         w = self._leftSibling(v)
         if w is not None:
             v_p_o = v
             v_p_i = v
             v_m_i = w
-            v_m_o = v_p_i.parent.children[0]
+            v_m_o = v_p_i.parent.visible[0]
             s_p_i = v_p_i.layout.mod
             s_p_o = v_p_o.layout.mod
             s_m_i = v_m_i.layout.mod
@@ -104,9 +1481,13 @@ class Tree:
                 v_p_i = v_p_i.nextLeft()
                 v_m_o = v_m_o.nextLeft()
                 v_p_o = v_p_o.nextRight()
+                if log is not None:
+                    log.append((v_p_o.layout, "ancestor",
+                                v_p_o.layout.ancestor))
                 v_p_o.layout.ancestor = v
                 shift = v_m_i.layout.prelim + s_m_i - \
-                    (v_p_i.layout.prelim + s_p_i) + distance
+                    (v_p_i.layout.prelim + s_p_i) + \
+                    (distance + 0.5 * (v_m_i.width + v_p_i.width))
                 if shift > 0:
                     self._moveSubtree(
                         self._ancestor(
@@ -118,9 +1499,15 @@ class Tree:
                 s_m_o = s_m_o + v_m_o.layout.mod
                 s_p_o = s_p_o + v_p_o.layout.mod
             if v_m_i.nextRight() and v_p_o.nextRight() is None:
+                if log is not None:
+                    log.append((v_p_o.layout, "thread", None))
+                    log.append((v_p_o.layout, "mod", v_p_o.layout.mod))
                 v_p_o.layout.thread = v_m_i.nextRight()
                 v_p_o.layout.mod = v_p_o.layout.mod + s_m_i - s_p_o
             if v_p_i.nextLeft() and v_m_o.nextLeft() is None:
+                if log is not None:
+                    log.append((v_m_o.layout, "thread", None))
+                    log.append((v_m_o.layout, "mod", v_m_o.layout.mod))
                 v_m_o.layout.thread = v_p_i.nextLeft()
                 v_m_o.layout.mod = v_m_o.layout.mod + s_p_i - s_m_o
                 defaultAncestor = v
@@ -157,9 +1544,9 @@ class Tree:
     def _executeShifts(v):
         shift = 0
         change = 0
-        i = len(v.children)
-        for i in myrange(len(v.children) - 1, -1, -1):
-            w = v.children[i]
+        i = len(v.visible)
+        for i in myrange(len(v.visible) - 1, -1, -1):
+            w = v.visible[i]
             w.layout.prelim = w.layout.prelim + shift
             w.layout.mod = w.layout.mod + shift
             change = change + w.layout.change
@@ -172,9 +1559,14 @@ class Tree:
         return defaultAncestor
 
 
-class Node:
+class Node(object):
+    __slots__ = ("tree", "depth", "data", "leftSibling", "_children",
+                 "visible", "parent", "layout", "width", "height")
+
+    class Layout(object):
+        __slots__ = ("node", "mod", "thread", "ancestor", "prelim", "shift",
+                     "change", "pos", "number", "log", "offset")
 
-    class Layout:
         def __init__(self, v):
             self.node = v
             self.mod = 0
@@ -185,6 +1577,16 @@ class Node:
             self.change = 0
             self.pos = [None, None]
             self.number = -1  # undefined
+            self.log = None  # changes to the subtree, incremental layout
+            self.offset = None  # mod sum of the children, incremental layout
+
+        def reset(self):
+            self.mod = 0
+            self.thread = None
+            self.ancestor = self.node
+            self.prelim = 0
+            self.shift = 0
+            self.change = 0
 
         def x(self, value=None):
             if value is not None:
@@ -197,23 +1599,59 @@ class Node:
                 self.pos[1] = value
             else:
                 if self.pos[1] is None:
-                    self.pos[1] = self.node.level()
+                    return self.node.level()
                 return self.pos[1]
 
-    def __init__(self, data):
+    def __init__(self, data, width=0, height=0):
         self.tree = None
+        self.depth = 0  # level, kept up to date by addNode
         self.data = data
+        self.width = width
+        self.height = height
         self.leftSibling = -1  # undefined, outdated
-        self.children = []
+        self._children = []
+        self.visible = self._children  # children that are laid out
         self.parent = None
         self.layout = self.Layout(self)
 
     def addNode(self, node):
         # Add an existing tree/node as a child
+        self._link(node)
+        return self._adopt(node)
+
+    def insertNode(self, index, node):
+        # Add an existing tree/node as a child at position index, like
+        # list.insert()
+        children = self._children
+        if index < 0:
+            index = max(0, len(children) + index)
+        if index >= len(children):
+            return self.addNode(node)
+        node.parent = self
+        children.insert(index, node)
+        self._renumber(index)
+        return self._adopt(node)
+
+    def _adopt(self, node):
+        # Add a linked child to the tree
+        if self.tree is not None:
+            self.tree._changed(self, node)
+
+        # Add to tree
+        if node._children:
+            # Graft a whole subtree: update tree and depth of all its nodes
+            self._attach(node)
+        else:
+            node.tree = self.tree
+            node.depth = self.depth + 1
+            if self.tree is not None:
+                self.tree._add(node)
+        return node
 
+    def _link(self, node):
         # Set left sibling
-        if self.children:
-            node.leftSibling = self.children[-1]
+        if self._children:
+            node.leftSibling = self._children[-1]
             node.layout.number = node.leftSibling.layout.number + 1
         else:
             node.leftSibling = None
@@ -221,73 +1659,164 @@ class Node:
 
         # Append to node
         node.parent = self
-        self.children.append(node)
+        self._children.append(node)
 
-        # Add to tree
-        root = self
-        i = 0
-        while root.parent is not None:
-            root = root.parent
-            i += 1
-        root.tree._add(node)
-        node.tree = root.tree
-        self.layout.pos[1] = i  # Level
-        return node
+    def _attach(self, node):
+        # Also links children lists that were assigned before the graft
+        tree = self.tree
+        stack = [(node, self.depth + 1)]
+        while stack:
+            v, depth = stack.pop()
+            v.tree = tree
+            v.depth = depth
+            if tree is not None:
+                tree._add(v)
+            last = None
+            for i, w in enumerate(v._children):
+                w.parent = v
+                w.leftSibling = last
+                w.layout.number = i
+                last = w
+            stack.extend([(w, depth + 1) for w in reversed(v._children)])
 
-    def addChild(self, data):
+    def addChild(self, data, width=0, height=0):
         # Create a new node and add it as a child
-        return self.addNode(Node(data))
+        return self.addNode(Node(data, width, height))
 
-    def removeChild(self, v):
-        j = -1
-        for i in myrange(len(self.children)):
-            if self.children[i] == v:
-                del self.children[i]
-                j = i
-                break
+    def insertChild(self, index, data, width=0, height=0):
+        # Create a new node and add it as a child at position index
+        return self.insertNode(index, Node(data, width, height))
 
-        for i in myrange(len(self.tree.nodes)):
-            if self.tree.nodes[i] == v:
-                del self.tree.nodes[i]
-                break
+    def moveChild(self, v, index):
+        # Move a child to position index among its siblings, like
+        # list.insert() after removing it
+        j = self._childIndex(v)
+        if j == -1:
+            raise ValueError("Not a child of this node")
+        children = self._children
+        del children[j]
+        if index < 0:
+            index = max(0, len(children) + index)
+        index = min(index, len(children))
+        children.insert(index, v)
+        self._renumber(min(j, index))
+        if self.tree is not None:
+            self.tree._changed(self)
+        return v
+
+    def _childIndex(self, v):
+        # Position of the child v, -1 if v is not a child
+        j = v.layout.number
+        children = self._children
+        if v.parent is not self or j < 0 or j >= len(children) or \
+                children[j] is not v:
+            # Number is undefined or outdated
+            for i in myrange(len(children)):
+                if children[i] is v:
+                    return i
+            return -1
+        return j
+
+    def _renumber(self, start):
+        # Update left sibling and number of the children from start on
+        children = self._children
+        for i in myrange(start, len(children)):
+            w = children[i]
+            w.leftSibling = children[i - 1] if i > 0 else None
+            w.layout.number = i
+
+    def setSize(self, width, height=0):
+        # Change the size, use this instead of setting width directly to
+        # keep an incremental layout up to date
+        self.width = width
+        self.height = height
+        if self.tree is not None:
+            self.tree._changed(self if self.parent is None else self.parent)
 
-        # Update left sibling
-        if j == 0:
-            self.children[0].leftSibling = None
-        elif j > 0:
-            self.children[j].leftSibling = self.children[j - 1]
-        else:  # j == -1
+    @property
+    def children(self):
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        # A new list: the old children that are not in it are removed from
+        # the tree, the new ones are added and linked by the next walk
+        if self.tree is not None:
+            kept = set(children)
+            for w in self._children:
+                if w not in kept and w.parent is self:
+                    self._detach(w)
+        if not self.collapsed:
+            self.visible = children
+        self._children = children
+        if self.tree is not None:
+            self.tree._linked = False
+            self.tree._version += 1
+            self.tree._index = None
+
+    @property
+    def collapsed(self):
+        # A collapsed node is laid out as a leaf, its subtree is hidden
+        return self.visible is not self._children
+
+    @collapsed.setter
+    def collapsed(self, value):
+        if value == self.collapsed:
             return
+        self.visible = () if value else self._children
+        if self.tree is not None:
+            # The next incremental walk lays out the children again
+            self.tree._changed(self)
+            for w in self.visible:
+                self.tree._changed(self, w)
 
-        # Update numbers
-        for i in myrange(j, len(self.children)):
-            self.children[i].layout.number = i
+    def removeChild(self, v):
+        # Remove a child and its whole subtree from the tree.
+        # The removed subtree stays intact and can be added again with
+        # addNode.
+        j = self._childIndex(v)
+        if j == -1:
+            return
+        del self._children[j]
+        if self.tree is not None:
+            self.tree._changed(self)
 
-        # Remove children of the deleted node
-        i = 0
-        while i < len(self.tree.nodes):
-            if self.tree.nodes[i] in v.children:
-                del self.tree.nodes[i]
-            else:
-                i += 1
+        # Update left sibling and numbers of the following siblings
+        self._renumber(j)
+        return self._detach(v)
 
-        v.children = []
+    def _detach(self, v):
+        # Remove the node and all its descendants from the tree
+        v.parent = None
+        v.leftSibling = -1
+        v.layout.number = -1
+        v.depth = 0
+        tree = self.tree
+        stack = [v]
+        while stack:
+            w = stack.pop()
+            if tree is not None:
+                tree._remove(w)
+            w.tree = None
+            stack.extend(w._children)
+        return v
 
     def nextLeft(self):
-        if self.children:
-            return self.children[0]
+        if self.visible:
+            return self.visible[0]
         else:
             return self.layout.thread
 
     def nextRight(self):
-        if self.children:
-            return self.children[-1]
+        if self.visible:
+            return self.visible[-1]
         else:
             return self.layout.thread
 
     def level(self):
-        if self.layout.pos[1] is not None:
-            return self.layout.pos[1]
+        if self.tree is not None or self.parent is None:
+            return self.depth
+        # Children that were not added with addNode, count the ancestors
         n = self.parent
         i = 0
         while n is not None:
@@ -302,14 +1831,10 @@ class Node:
          position(origin, 10)
          position(origin, 10, 15)
          position(origin, (10, 15))"""
-        if scaley is None:
-            if hasattr(scalex, "__getitem__"):
-                scaley = scalex[1]
-                scalex = scalex[0]
-            else:
-                scaley = scalex
-        return (origin[0] + int(math.ceil(self.layout.x() * scalex)),
-                origin[1] + int(math.ceil(self.layout.y() * scaley)))
+        scalex, scaley = _scales(scalex, scaley)
+        x, y = self._orientedPosition()
+        return (origin[0] + int(math.ceil(x * scalex)),
+                origin[1] + int(math.ceil(y * scaley)))
 
     def positionf(self, origin=(0.0, 0.0), scalex=1.0, scaley=None):
         """ Return position as floating point
@@ -318,14 +1843,16 @@ class Node:
          position(origin, 10)
          position(origin, 10, 15)
          position(origin, (10, 15))"""
-        if scaley is None:
-            if hasattr(scalex, "__getitem__"):
-                scaley = scalex[1]
-                scalex = scalex[0]
-            else:
-                scaley = scalex
-        return (origin[0] + (self.layout.x() * scalex),
-                origin[1] + (self.layout.y() * scaley))
+        scalex, scaley = _scales(scalex, scaley)
+        x, y = self._orientedPosition()
+        return (origin[0] + (x * scalex),
+                origin[1] + (y * scaley))
+
+    def _orientedPosition(self):
+        # Position in the orientation of the last walk of the tree
+        if self.tree is None:
+            return self.layout.x(), self.layout.y()
+        return self.tree._orientPoint(self.layout.x(), self.layout.y())
 
     def number(self):
         if self.layout.number != -1:
@@ -341,3 +1868,739 @@ class Node:
                     i += 1
             raise Exception("Error in number(self)!")
 
+
+class LayoutCache(object):
+    """ Cache for the layout of subtrees, for trees that contain many
+     subtrees with the same shape. Subtrees have the same shape if their
+     nodes have the same widths and the same number of children. At most
+     maxsize layouts are kept, the least recently used are removed first.
+     hits and misses count the lookups of subtrees and nodes counts the
+     nodes whose layout was copied from the cache.
+     Example:
+     cache = LayoutCache(1000)
+     T.walker(1.0, cache=cache)
+     print(cache.hits, cache.misses)"""
+
+    maxshapes = 1000000  # known shapes, the cache is cleared above this
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.nodes = 0
+        self._ids = {}
+        self._layouts = OrderedDict()
+
+    def __len__(self):
+        return len(self._layouts)
+
+    def clear(self):
+        self._ids = {}
+        self._layouts = OrderedDict()
+
+    def _shapes(self, root):
+        # Number the shapes of all subtrees: nodes with the same width and
+        # children with the same shapes get the same number. Returns the
+        # number of every node and how often each number occurs.
+        if len(self._ids) > self.maxshapes:
+            self.clear()
+        ids = self._ids
+        nodes = []
+        stack = [root]
+        while stack:
+            v = stack.pop()
+            nodes.append(v)
+            stack.extend(v.visible)
+        shapes = {}
+        counts = {}
+        for v in reversed(nodes):
+            key = (v.width, tuple([shapes[w] for w in v.visible]))
+            shape = ids.get(key)
+            if shape is None:
+                shape = ids[key] = len(ids)
+            shapes[v] = shape
+            counts[shape] = counts.get(shape, 0) + 1
+        return shapes, counts
+
+    @staticmethod
+    def _descendants(v):
+        # All nodes below v in pre-order
+        nodes = []
+        stack = list(reversed(v.visible))
+        while stack:
+            w = stack.pop()
+            nodes.append(w)
+            stack.extend(reversed(w.visible))
+        return nodes
+
+    def _store(self, v, key):
+        # Store the layout of the subtree of v after its first walk, before
+        # v itself is placed next to its siblings
+        nodes = self._descendants(v)
+        index = dict((w, i) for i, w in enumerate(nodes))
+        self._layouts[key] = (
+            [w.layout.prelim for w in nodes],
+            [w.layout.mod for w in nodes],
+            [index[w.layout.thread] if w.layout.thread is not None else -1
+             for w in nodes])
+        while len(self._layouts) > self.maxsize:
+            self._layouts.popitem(last=False)
+
+    def _copy(self, v, key):
+        # Copy a stored layout to the subtree of v, returns False if there
+        # is no layout for the shape
+        layout = self._layouts.pop(key, None)
+        if layout is None:
+            self.misses += 1
+            return False
+        self._layouts[key] = layout  # most recently used
+        self.hits += 1
+        nodes = self._descendants(v)
+        self.nodes += len(nodes)
+        _restore(nodes, *layout)
+        v.layout.reset()
+        return True
+
+
+class LayoutStats(object):
+    """ Statistics of a layout, returned by walker(stats=True).
+     timings contains the seconds of the phases firstWalk and secondWalk,
+     or of the whole incrementalWalk, and the total. moveSubtrees counts
+     the subtrees that were moved in this process. contourSteps, maxDepth
+     and nodes describe the laid out nodes: contourSteps is the number of
+     steps along the contours that a complete first walk takes in
+     _apportion, a large number compared to nodes shows an expensive
+     shape. Children of collapsed nodes are not counted.
+     Example:
+     stats = T.walker(1.0, stats=True)
+     print(stats.asDict())"""
+
+    def __init__(self):
+        self.timings = {}
+        self.moveSubtrees = 0
+        self.contourSteps = 0
+        self.maxDepth = 0
+        self.nodes = 0
+
+    def __repr__(self):
+        return "LayoutStats(%s)" % ", ".join(
+            "%s=%r" % item for item in sorted(self.asDict().items()))
+
+    def asDict(self):
+        return {
+            "timings": dict(self.timings),
+            "moveSubtrees": self.moveSubtrees,
+            "contourSteps": self.contourSteps,
+            "maxDepth": self.maxDepth,
+            "nodes": self.nodes,
+        }
+
+    def _counted(self, moveSubtree):
+        # _moveSubtree that counts its calls
+        def counted(w_m, w_p, shift):
+            self.moveSubtrees += 1
+            moveSubtree(w_m, w_p, shift)
+        return counted
+
+    def _measure(self, root):
+        # Count the nodes and levels. _apportion follows the contours of a
+        # node and its left siblings until the lower of both ends, so the
+        # steps follow from the heights of the subtrees.
+        nodes = []
+        stack = [(root, 0)]
+        while stack:
+            v, depth = stack.pop()
+            nodes.append(v)
+            if depth > self.maxDepth:
+                self.maxDepth = depth
+            stack.extend([(w, depth + 1) for w in v.visible])
+        self.nodes = len(nodes)
+        height = {}
+        for v in reversed(nodes):
+            h = 0
+            left = -1  # height of the left siblings
+            for w in v.visible:
+                if left >= 0:
+                    self.contourSteps += min(left, height[w])
+                left = max(left, height[w])
+                h = max(h, height[w] + 1)
+            height[v] = h
+
+
+class Forest(object):
+    """ Many trees that are laid out next to each other in one pass.
+     The trees are placed from left to right, separated by their bounding
+     boxes or, with pack=True, by their contours so that a small tree can
+     move under a wide level of its left neighbour. All coordinates are
+     returned in one array.
+     Example:
+     F = Forest.fromParentArray([-1, 0, 0, -1, 3])
+     F.walker(1.0, pack=True)
+     xy = F.coordinates()"""
+
+    def __init__(self, trees=()):
+        self.trees = list(trees)
+
+    def __len__(self):
+        return len(self.trees)
+
+    def __iter__(self):
+        return iter(self.trees)
+
+    @classmethod
+    def fromParentArray(cls, parents, data=None):
+        """ Build all trees from the parent index of every node.
+         Every node with the parent -1 or None is the root of a tree, the
+         trees are ordered by the index of their root. See
+         Tree.fromParentArray()"""
+        if data is None:
+            data = myrange(len(parents))
+        nodes = [Node(d) for d in data]
+        if len(nodes) != len(parents):
+            raise ValueError("parents and data have different lengths")
+        roots = []
+        for i, p in enumerate(parents):
+            if p is None or p < 0:
+                roots.append(nodes[i])
+            else:
+                nodes[p]._link(nodes[i])
+        # Sort the nodes by tree, in the order of their index
+        owner = {}
+        for k, root in enumerate(roots):
+            stack = [root]
+            while stack:
+                v = stack.pop()
+                owner[v] = k
+                stack.extend(v.children)
+        groups = [[] for root in roots]
+        for v in nodes:
+            k = owner.get(v)
+            if k is None:
+                raise ValueError("Not all nodes are connected to a root")
+            groups[k].append(v)
+        return cls([Tree._fromRoot(root, group)
+                    for root, group in zip(roots, groups)])
+
+    def add(self, tree):
+        # Append a tree
+        self.trees.append(tree)
+        return tree
+
+    def addTree(self, data):
+        # Append a new tree with a root node
+        return self.add(Tree(data))
+
+    def walker(self, distance=1.0, subtreeDistance=None, treeDistance=None,
+               pack=False):
+        # Lay out all trees, see Tree.walker(). treeDistance is the gap
+        # between neighbouring trees, by default subtreeDistance. The root
+        # of the first tree is at x = 0.
+        if subtreeDistance is None:
+            subtreeDistance = distance
+        if treeDistance is None:
+            treeDistance = subtreeDistance
+        edge = []  # Right border of the placed trees on each level
+        for T in self.trees:
+            root = T.root
+            T._walked = None
+            T._index = None
+            T._previous = None
+            T._orientation = "top"
+            if not T._linked:
+                T.normalize()
+            T._firstWalkIterative(root, distance, subtreeDistance)
+            lefts, rights = T._contours()
+            if not pack:
+                lefts = [min(lefts)]
+                rights = [max(rights)]
+            offset = 0.0
+            if edge:
+                offset = max([r - l for r, l in zip(edge, lefts)]) + \
+                    treeDistance
+            edge[:len(rights)] = [offset + r for r in rights]
+            if T._secondWalkIterative(root, offset - root.layout.prelim):
+                T._spreadLevels(root)
+
+    def coordinates(self, origin=(0.0, 0.0), scalex=1.0, scaley=None):
+        """ Return the positions of the nodes of all trees as one flat
+         array("d") x0, y0, x1, y1, ... in the order of the trees and
+         Tree.nodes. See Tree.coordinates()"""
+        xy = array("d")
+        for T in self.trees:
+            xy.extend(T._positions())
+        return _transform(xy, origin, scalex, scaley)
+
+    def parentIndices(self):
+        # Index of the parent of every node in the order of coordinates(),
+        # -1 for the roots
+        result = array("i")
+        start = 0
+        for T in self.trees:
+            indices = T.parentIndices()
+            result.extend([i + start if i != -1 else -1 for i in indices])
+            start += len(indices)
+        return result
+
+    def treeIndices(self):
+        # Index of the first node of every tree in the order of
+        # coordinates() and the total number of nodes at the end, the nodes
+        # of tree k are treeIndices()[k] to treeIndices()[k + 1] - 1
+        result = array("i", [0])
+        for T in self.trees:
+            result.append(result[-1] + len(T))
+        return result
+
+
+class CompactTree(object):
+    """ A tree stored in flat arrays instead of Node objects.
+     Nodes are referenced by their integer index, the root has index 0.
+     The layout is calculated with the same algorithm as Tree.walker() and
+     gives the same coordinates, but needs only a fraction of the memory.
+     Example:
+     T = CompactTree("a1")
+     b = T.addChild(0, "b2")
+     c = T.addChild(b, "c3")
+     T.walker(1.0)
+     T.positionf(c)"""
+
+    def __init__(self, data=None, width=0.0):
+        self.data = [data]
+        # Structure
+        self.parent = array("i", [-1])
+        self.firstChild = array("i", [-1])
+        self.lastChild = array("i", [-1])
+        self.nextSibling = array("i", [-1])
+        self.leftSibling = array("i", [-1])
+        self.number = array("i", [0])
+        self.depth = array("i", [0])
+        self.width = array("d", [width])
+        # Layout, the scratch columns are allocated by walker()
+        self.prelim = None
+        self.mod = None
+        self.shift = None
+        self.change = None
+        self.thread = None
+        self.ancestor = None
+        self.x = array("d", [0.0])
+
+    def __len__(self):
+        return len(self.parent)
+
+    @classmethod
+    def fromTree(cls, tree):
+        # Copy a Tree, the nodes are numbered in pre-order
+        node = tree if isinstance(tree, Node) else tree.root
+        T = cls(node.data, node.width)
+        stack = [(w, 0) for w in reversed(node.children)]
+        while stack:
+            node, parent = stack.pop()
+            i = T.addChild(parent, node.data, node.width)
+            stack.extend([(w, i) for w in reversed(node.children)])
+        return T
+
+    def addChild(self, parent, data=None, width=0.0):
+        # Add a child to the node with index parent, return the new index
+        i = len(self.parent)
+        last = self.lastChild[parent]
+        self.data.append(data)
+        self.width.append(width)
+        self.parent.append(parent)
+        self.firstChild.append(-1)
+        self.lastChild.append(-1)
+        self.nextSibling.append(-1)
+        self.leftSibling.append(last)
+        self.depth.append(self.depth[parent] + 1)
+        self.x.append(0.0)
+        if last == -1:
+            self.firstChild[parent] = i
+            self.number.append(0)
+        else:
+            self.nextSibling[last] = i
+            self.number.append(self.number[last] + 1)
+        self.lastChild[parent] = i
+        return i
+
+    @classmethod
+    def _fromParents(cls, parents, widths):
+        # Tree from the parent indices and widths of its nodes in one pass,
+        # the parent of every node comes before the node
+        n = len(parents)
+        T = cls(None, widths[0])
+        T.data = [None] * n
+        T.parent = array("i", parents)
+        T.width = array("d", widths)
+        T.x = array("d", [0.0]) * n
+        firstChild = T.firstChild = array("i", [-1]) * n
+        lastChild = T.lastChild = array("i", [-1]) * n
+        nextSibling = T.nextSibling = array("i", [-1]) * n
+        leftSibling = T.leftSibling = array("i", [-1]) * n
+        number = T.number = array("i", [0]) * n
+        depth = T.depth = array("i", [0]) * n
+        for i in myrange(1, n):
+            p = parents[i]
+            last = lastChild[p]
+            if last == -1:
+                firstChild[p] = i
+            else:
+                nextSibling[last] = i
+                leftSibling[i] = last
+                number[i] = number[last] + 1
+            lastChild[p] = i
+            depth[i] = depth[p] + 1
+        return T
+
+    def children(self, i):
+        # Indices of the children of node i
+        result = []
+        w = self.firstChild[i]
+        while w != -1:
+            result.append(w)
+            w = self.nextSibling[w]
+        return result
+
+    def walker(self, distance=1.0, subtreeDistance=None):
+        # See Tree.walker()
+        if subtreeDistance is None:
+            subtreeDistance = distance
+        self._prepare()
+        self._firstWalk(distance, subtreeDistance)
+        self._secondWalk()
+
+    def _prepare(self):
+        # Allocate the scratch columns of the layout
+        n = len(self.parent)
+        self.prelim = array("d", [0.0]) * n
+        self.mod = array("d", [0.0]) * n
+        self.shift = array("d", [0.0]) * n
+        self.change = array("d", [0.0]) * n
+        self.thread = array("i", [-1]) * n
+        self.ancestor = array("i", myrange(n))
+        if len(self.x) != n:
+            self.x = array("d", [0.0]) * n
+
+    def _firstWalk(self, distance, subtreeDistance):
+        # Post-order traversal, same operations as Tree._firstWalk
+        firstChild = self.firstChild
+        lastChild = self.lastChild
+        nextSibling = self.nextSibling
+        leftSibling = self.leftSibling
+        prelim = self.prelim
+        mod = self.mod
+        shift = self.shift
+        change = self.change
+        width = self.width
+        nodes = [0]
+        cursor = [firstChild[0]]
+        ancestors = [firstChild[0]]
+        while nodes:
+            c = cursor[-1]
+            if c != -1:
+                cursor[-1] = nextSibling[c]
+                nodes.append(c)
+                cursor.append(firstChild[c])
+                ancestors.append(firstChild[c])
+                continue
+            v = nodes.pop()
+            cursor.pop()
+            ancestors.pop()
+            ls = leftSibling[v]
+            first = firstChild[v]
+            if first != -1:
+                # Execute shifts
+                s = 0
+                ch = 0
+                w = lastChild[v]
+                while w != -1:
+                    prelim[w] = prelim[w] + s
+                    mod[w] = mod[w] + s
+                    ch = ch + change[w]
+                    s = s + shift[w] + ch
+                    w = leftSibling[w]
+                midpoint = 0.5 * (prelim[first] + prelim[lastChild[v]])
+                if ls != -1:
+                    prelim[v] = prelim[ls] + \
+                        (distance + 0.5 * (width[ls] + width[v]))
+                    mod[v] = prelim[v] - midpoint
+                else:
+                    prelim[v] = midpoint
+            elif ls != -1:
+                prelim[v] = prelim[ls] + \
+                    (distance + 0.5 * (width[ls] + width[v]))
+            if nodes:
+                ancestors[-1] = self._apportion(v, ancestors[-1],
+                                                subtreeDistance)
+
+    def _apportion(self, v, defaultAncestor, distance):
+        w = self.leftSibling[v]
+        if w == -1:
+            return defaultAncestor
+        parent = self.parent
+        firstChild = self.firstChild
+        lastChild = self.lastChild
+        number = self.number
+        prelim = self.prelim
+        mod = self.mod
+        thread = self.thread
+        ancestor = self.ancestor
+        width = self.width
+        v_p_o = v
+        v_p_i = v
+        v_m_i = w
+        v_m_o = firstChild[parent[v]]
+        s_p_i = mod[v_p_i]
+        s_p_o = mod[v_p_o]
+        s_m_i = mod[v_m_i]
+        s_m_o = mod[v_m_o]
+        while True:
+            # nextRight(v_m_i) and nextLeft(v_p_i)
+            right = lastChild[v_m_i]
+            if right == -1:
+                right = thread[v_m_i]
+            left = firstChild[v_p_i]
+            if left == -1:
+                left = thread[v_p_i]
+            if right == -1 or left == -1:
+                break
+            v_m_i = right
+            v_p_i = left
+            left = firstChild[v_m_o]
+            v_m_o = left if left != -1 else thread[v_m_o]
+            right = lastChild[v_p_o]
+            v_p_o = right if right != -1 else thread[v_p_o]
+            ancestor[v_p_o] = v
+            shift = prelim[v_m_i] + s_m_i - (prelim[v_p_i] + s_p_i) + \
+                (distance + 0.5 * (width[v_m_i] + width[v_p_i]))
+            if shift > 0:
+                # Move subtree
+                w_m = ancestor[v_m_i]
+                if parent[w_m] != parent[v]:
+                    w_m = defaultAncestor
+                subtrees = number[v] - number[w_m]
+                if subtrees == 0:
+                    subtrees = 0.0000001
+                self.change[v] = self.change[v] - shift / subtrees
+                self.shift[v] = self.shift[v] + shift
+                self.change[w_m] = self.change[w_m] + shift / subtrees
+                prelim[v] = prelim[v] + shift
+                mod[v] = mod[v] + shift
+                s_p_i = s_p_i + shift
+                s_p_o = s_p_o + shift
+            s_m_i = s_m_i + mod[v_m_i]
+            s_p_i = s_p_i + mod[v_p_i]
+            s_m_o = s_m_o + mod[v_m_o]
+            s_p_o = s_p_o + mod[v_p_o]
+        right = lastChild[v_m_i]
+        if right == -1:
+            right = thread[v_m_i]
+        if right != -1 and lastChild[v_p_o] == -1 and thread[v_p_o] == -1:
+            thread[v_p_o] = right
+            mod[v_p_o] = mod[v_p_o] + s_m_i - s_p_o
+        left = firstChild[v_p_i]
+        if left == -1:
+            left = thread[v_p_i]
+        if left != -1 and firstChild[v_m_o] == -1 and thread[v_m_o] == -1:
+            thread[v_m_o] = left
+            mod[v_m_o] = mod[v_m_o] + s_p_i - s_m_o
+            defaultAncestor = v
+        return defaultAncestor
+
+    def _secondWalk(self):
+        # Pre-order traversal
+        firstChild = self.firstChild
+        nextSibling = self.nextSibling
+        prelim = self.prelim
+        mod = self.mod
+        x = self.x
+        stack = [(0, -prelim[0])]
+        while stack:
+            v, m = stack.pop()
+            x[v] = prelim[v] + m
+            w = firstChild[v]
+            if w != -1:
+                m = m + mod[v]
+                while w != -1:
+                    stack.append((w, m))
+                    w = nextSibling[w]
+
+    def y(self, i):
+        return self.depth[i]
+
+    def coordinates(self, origin=(0.0, 0.0), scalex=1.0, scaley=None):
+        """ Return the positions of all nodes as a flat array("d")
+         x0, y0, x1, y1, ... see Tree.coordinates()"""
+        xy = array("d", [0.0]) * (2 * len(self.x))
+        xy[0::2] = self.x
+        xy[1::2] = array("d", self.depth)
+        return _transform(xy, origin, scalex, scaley)
+
+    def positionf(self, i, origin=(0.0, 0.0), scalex=1.0, scaley=None):
+        """ Return position of node i as floating point
+         Examples:
+         positionf(i, origin)
+         positionf(i, origin, 10)
+         positionf(i, origin, 10, 15)
+         positionf(i, origin, (10, 15))"""
+        scalex, scaley = _scales(scalex, scaley)
+        return (origin[0] + (self.x[i] * scalex),
+                origin[1] + (self.depth[i] * scaley))
+
+    def position(self, i, origin=(0, 0), scalex=1.0, scaley=None):
+        """ Return position of node i as integer
+         Examples:
+         position(i, origin)
+         position(i, origin, 10)
+         position(i, origin, 10, 15)
+         position(i, origin, (10, 15))"""
+        scalex, scaley = _scales(scalex, scaley)
+        return (origin[0] + int(math.ceil(self.x[i] * scalex)),
+                origin[1] + int(math.ceil(self.depth[i] * scaley)))
+
+
+class LayoutSnapshot(object):
+    """ A tree and its layout written by Tree.writeSnapshot(), mapped into
+     memory. Nodes are referenced by their index in Tree.nodes of the saved
+     tree. Opening is O(1): coordinates and data are read from the file
+     when they are accessed and Node objects are only created by toTree().
+     f is a file name or a binary file object. The orientation of the
+     saved layout is in the attribute orientation.
+     Example:
+     with LayoutSnapshot("tree.layout") as S:
+         xy = S.coordinates((400, 20), 50, 80)
+         print(S.data(0), S.positionf(0))"""
+
+    _magic = b"TDRW"
+    _version = 3
+    _header = struct.Struct("<4sIQ8sdd")
+
+    def __init__(self, f):
+        if hasattr(f, "fileno"):
+            self._file = None
+            fileno = f.fileno()
+        else:
+            self._file = open(f, "rb")
+            fileno = self._file.fileno()
+        self._map = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        (magic, version, n, orientation,
+         left, span) = self._header.unpack_from(self._map, 0)
+        if magic != self._magic or version != self._version:
+            self.close()
+            raise ValueError("Not a layout snapshot")
+        self._n = n
+        self.orientation = orientation.rstrip(b"\0").decode("ascii")
+        self._radial = (left, span)
+        # Offsets of the columns
+        self._x = self._header.size
+        self._y = self._x + 8 * n
+        self._width = self._y + 8 * n
+        self._height = self._width + 8 * n
+        self._offsets = self._height + 8 * n
+        self._parent = self._offsets + 8 * (n + 1)
+        self._number = self._parent + 4 * n
+        self._strings = self._number + 4 * n
+
+    def __len__(self):
+        return self._n
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._map.close()
+        if self._file is not None:
+            self._file.close()
+
+    def _column(self, typecode, start, size):
+        return _frombytes(typecode, self._map[start:start + size * self._n])
+
+    def _value(self, fmt, start, size, i):
+        if not 0 <= i < self._n:
+            raise IndexError("node index out of range")
+        return struct.unpack_from(fmt, self._map, start + size * i)[0]
+
+    def x(self, i):
+        # Top down x of node i, positionf() applies the orientation
+        return self._value("<d", self._x, 8, i)
+
+    def y(self, i):
+        return self._value("<d", self._y, 8, i)
+
+    def parent(self, i):
+        return self._value("<i", self._parent, 4, i)
+
+    def size(self, i):
+        # Width and height of node i
+        return (self._value("<d", self._width, 8, i),
+                self._value("<d", self._height, 8, i))
+
+    def data(self, i):
+        if not 0 <= i < self._n:
+            raise IndexError("node index out of range")
+        start, end = struct.unpack_from("<qq", self._map,
+                                        self._offsets + 8 * i)
+        return json.loads(self._map[self._strings + start:
+                                    self._strings + end].decode("utf-8"))
+
+    def coordinates(self, origin=(0.0, 0.0), scalex=1.0, scaley=None):
+        """ Return the positions of all nodes as a flat array("d")
+         x0, y0, x1, y1, ... see Tree.coordinates()"""
+        xy = array("d", [0.0]) * (2 * self._n)
+        xy[0::2] = self._column("d", self._x, 8)
+        xy[1::2] = self._column("d", self._y, 8)
+        _orientedArray(xy, self.orientation, self._radial)
+        return _transform(xy, origin, scalex, scaley)
+
+    def parentIndices(self):
+        # Index of the parent of every node, -1 for the root
+        return self._column("i", self._parent, 4)
+
+    def positionf(self, i, origin=(0.0, 0.0), scalex=1.0, scaley=None):
+        """ Return position of node i as floating point
+         Examples:
+         positionf(i, origin)
+         positionf(i, origin, 10)
+         positionf(i, origin, 10, 15)
+         positionf(i, origin, (10, 15))"""
+        scalex, scaley = _scales(scalex, scaley)
+        x, y = _oriented(self.x(i), self.y(i), self.orientation, self._radial)
+        return (origin[0] + (x * scalex),
+                origin[1] + (y * scaley))
+
+    def toTree(self):
+        # Create the Tree with its layout
+        n = self._n
+        parents = self.parentIndices()
+        numbers = self._column("i", self._number, 4)
+        nodes = [Node(self.data(i)) for i in myrange(n)]
+        root = None
+        # Link the children in the order of their index among the siblings
+        for i in sorted(myrange(n), key=numbers.__getitem__):
+            if parents[i] < 0:
+                root = nodes[i]
+            else:
+                nodes[parents[i]]._link(nodes[i])
+        T = Tree._fromRoot(root, nodes)
+        xs = self._column("d", self._x, 8)
+        ys = self._column("d", self._y, 8)
+        widths = self._column("d", self._width, 8)
+        heights = self._column("d", self._height, 8)
+        for i, v in enumerate(T._nodes):
+            v.width = widths[i]
+            v.height = heights[i]
+            v.layout.pos[0] = xs[i]
+            v.layout.pos[1] = ys[i]
+        T._orientation = self.orientation
+        T._radial = self._radial
+        return T
+
+
+def _walkSubtree(job):
+    # Worker of Tree.walker(workers=n): first walk of a subtree given as
+    # parent indices and widths, returns the relative layout of its nodes
+    parents, widths, distance, subtreeDistance = job
+    T = CompactTree._fromParents(parents, widths)
+    T._prepare()
+    T._firstWalk(distance, subtreeDistance)
+    return T.prelim, T.mod, T.thread